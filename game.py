@@ -1,25 +1,39 @@
+import argparse
+import asyncio
+import io
 import random
-import re
+import sys
 import time
 import os
+from enum import IntEnum
 from typing import List, Dict, Optional
-from llm_client import create_llm_client
+from llm_client import LLMClient, create_llm_client, CachedLLMClient, SemanticCachedLLMClient, close_async_clients
 
 # Debug settings
 DEBUG = True  # Set to True for debugging output
-# ANSI color codes for better visibility
-COLORS = {
-    "reset": "\033[0m",
-    "red": "\033[91m",
-    "green": "\033[92m",
-    "yellow": "\033[93m",
-    "blue": "\033[94m",
-    "magenta": "\033[95m",
-    "cyan": "\033[96m",
-    "white": "\033[97m",
-    "bold": "\033[1m",
-    "underline": "\033[4m"
+# Semantic cache similarity threshold for the log part of negotiation requests;
+# the proposal and game state must match exactly (see get_neg_messages)
+SEMANTIC_NEG_THRESHOLD = 0.99
+# Number of recent log entries included in player prompts
+PLAYER_LOG_WINDOW = 20
+# Reply cap for negotiation answers ("Agree"/"Decline" and a short reason)
+NEG_MAX_TOKENS = 128
+
+# ANSI SGR parameters for better visibility
+SGR_CODES = {
+    "reset": "0",
+    "red": "91",
+    "green": "92",
+    "yellow": "93",
+    "blue": "94",
+    "magenta": "95",
+    "cyan": "96",
+    "white": "97",
+    "bold": "1",
+    "underline": "4"
 }
+# ANSI color codes for better visibility
+COLORS = {key: f"\033[{code}m" for key, code in SGR_CODES.items()}
 
 # Check if we're in Windows CMD (which needs colorama for ANSI codes)
 if os.name == 'nt':
@@ -31,27 +45,104 @@ if os.name == 'nt':
         for key in COLORS:
             COLORS[key] = ""
 
+def sgr(*names):
+    """Return a single ANSI sequence combining several COLORS entries"""
+    if not COLORS["reset"]:
+        return ""
+    return "\033[" + ";".join(SGR_CODES[name] for name in names) + "m"
+
+# Pre-encoded escape sequences for the byte-level print helpers
+_COLORS_B = {key: value.encode("ascii") for key, value in COLORS.items()}
+_HEADER_B = {key: sgr(key, "bold").encode("ascii") for key in SGR_CODES}
+_DEBUG_PREFIX_B = _COLORS_B["blue"] + "[DEBUG] ".encode("utf-8")
+_EVENT_PREFIX_B = _COLORS_B["green"] + "➤ ".encode("utf-8")
+_WARNING_PREFIX_B = _COLORS_B["red"] + "⚠ ".encode("utf-8")
+_LINE_END_B = _COLORS_B["reset"] + b"\n"
+
+def _write_bytes(buf):
+    """Write UTF-8 encoded output to stdout with a single call"""
+    out = sys.stdout
+    raw = getattr(out, "buffer", None)
+    # colorama wraps the text stream on Windows, and other encodings need print()
+    if raw is None or os.name == 'nt' or (out.encoding or "").lower().replace("-", "") != "utf8":
+        print(buf.decode("utf-8"), end="")
+        return
+    out.flush()  # Keep ordering with text already written through print()
+    raw.write(buf)
+    if out.line_buffering:
+        raw.flush()
+
 def print_header(text, color="yellow", width=80):
     """Print a centered header with a colored background"""
-    print(f"\n{COLORS[color]}{COLORS['bold']}{text.center(width)}{COLORS['reset']}\n")
+    buf = bytearray(b"\n")
+    buf += _HEADER_B[color]
+    buf += text.center(width).encode("utf-8")
+    buf += _COLORS_B["reset"]
+    buf += b"\n\n"
+    _write_bytes(buf)
     
-def print_debug(text):
-    """Print debug information if DEBUG is enabled"""
-    if DEBUG:
-        print(f"{COLORS['blue']}[DEBUG] {text}{COLORS['reset']}")
+def _print_debug(text):
+    """Print debug information"""
+    _write_bytes(_DEBUG_PREFIX_B + text.encode("utf-8") + _LINE_END_B)
+
+# With DEBUG off, print_debug is a no-op and formatted call sites sit behind `if DEBUG:`
+print_debug = _print_debug if DEBUG else (lambda text: None)
 
 def print_event(text):
     """Print game event information"""
-    print(f"{COLORS['green']}➤ {text}{COLORS['reset']}")
+    _write_bytes(_EVENT_PREFIX_B + text.encode("utf-8") + _LINE_END_B)
 
 def print_warning(text):
     """Print warning information"""
-    print(f"{COLORS['red']}⚠ {text}{COLORS['reset']}")
+    _write_bytes(_WARNING_PREFIX_B + text.encode("utf-8") + _LINE_END_B)
 
 def print_divider(char="=", width=80):
     """Print a divider line"""
     print(char * width)
 
+def _between(text, open_tok, close_tok):
+    """Return the stripped text between two markers, or None if either is missing"""
+    start = text.find(open_tok)
+    if start < 0:
+        return None
+    start += len(open_tok)
+    end = text.find(close_tok, start)
+    if end < 0:
+        return None
+    return text[start:end].strip()
+
+class LogKind(IntEnum):
+    """Kinds of game log entries"""
+    INIT = 0
+    CHECK = 1
+    FIRE = 2
+    CONTRACT_END = 3
+    ITEM = 4
+    MESSAGE = 5
+
+def _format_init(actor, payload, for_player):
+    bullet_count, positions, start = payload
+    if for_player:
+        return f"游戏初始化: {bullet_count}个子弹被随机装入，初始扳机位置为{start + 1}"
+    return f"游戏初始化: {bullet_count}个子弹被随机装入位置 {[pos+1 for pos in positions]}，初始扳机位置为{start + 1}"
+
+def _format_item(actor, payload, for_player):
+    item, spec_message = payload
+    if for_player:
+        return f"{actor} 使用了 {item}"
+    return f"{actor} 使用了 {item}：{spec_message}"
+
+# Formatter per log kind, called as (actor, payload, for_player).
+# A formatter returns None for entries hidden from players.
+_LOG_FORMATTERS = {
+    LogKind.INIT: _format_init,
+    LogKind.CHECK: lambda actor, payload, for_player: None if for_player else f"{actor} 查看位置 {payload[0]+1}: {'有子弹' if payload[1] else '空弹巢'}",
+    LogKind.FIRE: lambda actor, payload, for_player: f"在位置 {payload[0]+1} 开火，结果: {'命中' if payload[1] else '空弹'}",
+    LogKind.CONTRACT_END: lambda actor, payload, for_player: "契约效果已结束",
+    LogKind.ITEM: _format_item,
+    LogKind.MESSAGE: lambda actor, payload, for_player: payload[0],
+}
+
 class Role:
     def __init__(self, name: str, style: str):
         self.name = name
@@ -60,40 +151,54 @@ class Role:
 class GameState:
     def __init__(self, chamber_count: int):
         self.chamber_count = chamber_count
-        self.bullets = []
+        self._bullets_set = set()  # Bullet positions for membership tests
+        self._bullets_sorted = []  # Same positions in order, for logs and stats
+        self._empty_set = set(range(chamber_count))  # Positions without a bullet
         self.current_position = 0
-        self.logs = []  # Full logs with all information (for spectators)
-        self.player_logs = []  # Limited logs for players (no bullet positions)
+        # Log entries are stored as parallel columns and only formatted in get_status,
+        # where spectators see everything and players get a limited view
+        self._log_actor = []
+        self._log_kind = []
+        self._log_payload = []
         self.contract_active = False
         self.contract_turns_left = 0
         self.reverse_active = False
         self.last_active_player = None
     
+    @property
+    def bullets(self) -> List[int]:
+        """Sorted list of chamber positions holding a bullet"""
+        return self._bullets_sorted
+    
+    def add_log(self, kind: LogKind, actor: Optional[str] = None, payload: tuple = ()):
+        """Record a log entry"""
+        self._log_actor.append(actor)
+        self._log_kind.append(kind)
+        self._log_payload.append(payload)
+    
     def initialize_gun(self):
         # Randomly place 1 to floor(x/2) bullets
         bullet_count = random.randint(1, self.chamber_count // 2)
         all_positions = list(range(self.chamber_count))
         random.shuffle(all_positions)
-        self.bullets = sorted(all_positions[:bullet_count])  # Sort for better readability
+        self._bullets_sorted = sorted(all_positions[:bullet_count])  # Sort for better readability
+        self._bullets_set = set(self._bullets_sorted)
+        self._empty_set = set(all_positions[bullet_count:])
         self.current_position = random.randint(0, self.chamber_count - 1)
         
-        # Log for spectators with bullet positions
-        self.logs.append(f"游戏初始化: {bullet_count}个子弹被随机装入位置 {[pos+1 for pos in self.bullets]}，初始扳机位置为{self.current_position + 1}")
-        
-        # Log for players without bullet positions
-        self.player_logs.append(f"游戏初始化: {bullet_count}个子弹被随机装入，初始扳机位置为{self.current_position + 1}")
+        # Bullet positions are only shown to spectators
+        self.add_log(LogKind.INIT, None, (bullet_count, tuple(self._bullets_sorted), self.current_position))
         
         # Debug output for bullet positions
         if DEBUG:
-            print_debug(f"Bullets placed at positions: {[pos+1 for pos in self.bullets]}")
+            print_debug(f"Bullets placed at positions: {[pos+1 for pos in self._bullets_sorted]}")
     
     def add_bullet(self):
-        # Find empty chambers
-        empty_chambers = [i for i in range(self.chamber_count) if i not in self.bullets]
-        if empty_chambers:
-            new_bullet = random.choice(empty_chambers)
-            self.bullets.append(new_bullet)
-            self.bullets.sort()  # Keep sorted for easier debugging
+        if self._empty_set:
+            new_bullet = random.choice(tuple(self._empty_set))
+            self._empty_set.discard(new_bullet)
+            self._bullets_set.add(new_bullet)
+            self._bullets_sorted = sorted(self._bullets_set)  # Keep sorted for easier debugging
             
             # Different logs for spectators vs players
             spec_msg = f"子弹被添加到位置 {new_bullet+1}"
@@ -110,13 +215,11 @@ class GameState:
         if position < 0 or position >= self.chamber_count:
             raise ValueError(f"Position must be between 0 and {self.chamber_count-1}")
         
-        has_bullet = position in self.bullets
+        has_bullet = position in self._bullets_set
         
-        # Log for spectators
-        self.logs.append(f"{player_name} 查看位置 {position+1}: {'有子弹' if has_bullet else '空弹巢'}")
-        
-        # For players, this info is directly returned to the checking player
-        # but not added to player_logs to avoid leaking information
+        # Log for spectators. For players, this info is directly returned to the
+        # checking player but hidden from the player log to avoid leaking information
+        self.add_log(LogKind.CHECK, player_name, (position, has_bullet))
         
         return has_bullet
     
@@ -147,13 +250,10 @@ class GameState:
 
     def fire(self) -> bool:
         """Fire the gun at current position and return True if it was a bullet"""
-        was_bullet = self.current_position in self.bullets
-        
-        # Log for spectators with full information
-        self.logs.append(f"在位置 {self.current_position+1} 开火，结果: {'命中' if was_bullet else '空弹'}")
+        was_bullet = self.current_position in self._bullets_set
         
-        # Log for players with same information (result is publicly visible)
-        self.player_logs.append(f"在位置 {self.current_position+1} 开火，结果: {'命中' if was_bullet else '空弹'}")
+        # Same information for spectators and players (result is publicly visible)
+        self.add_log(LogKind.FIRE, None, (self.current_position, was_bullet))
         
         # Move to next chamber after firing
         self.current_position = (self.current_position + 1) % self.chamber_count
@@ -163,8 +263,7 @@ class GameState:
             self.contract_turns_left -= 1
             if self.contract_turns_left <= 0:
                 self.contract_active = False
-                self.logs.append("契约效果已结束")
-                self.player_logs.append("契约效果已结束")
+                self.add_log(LogKind.CONTRACT_END)
         
         return was_bullet
     
@@ -172,42 +271,66 @@ class GameState:
         """Get formatted game logs for display
         
         Args:
-            for_player: If True, return limited logs for players
+            for_player: If True, return limited logs for players. Player logs keep
+                the opening entry and the last PLAYER_LOG_WINDOW entries so prompt
+                size stays bounded
         """
-        logs_to_use = self.player_logs if for_player else self.logs
-        if not logs_to_use:
+        lines = []
+        for kind, actor, payload in zip(self._log_kind, self._log_actor, self._log_payload):
+            line = _LOG_FORMATTERS[kind](actor, payload, for_player)
+            if line is not None:
+                lines.append(line)
+        if not lines:
             return "游戏刚刚开始"
-        return "\n".join(logs_to_use)
+        if for_player and len(lines) > PLAYER_LOG_WINDOW + 1:
+            # The opening entry holds the bullet count, so it is always kept
+            omitted = len(lines) - PLAYER_LOG_WINDOW - 1
+            lines = [lines[0], "[早期省略 %d 条]" % omitted] + lines[-PLAYER_LOG_WINDOW:]
+        return "\n".join(lines)
     
     def visualize_gun(self) -> str:
         """Visualize the current state of the gun for spectators"""
-        chambers = []
-        chambers.append(f"{COLORS['yellow']}Gun state: ({self.current_position + 1}/{self.chamber_count}){COLORS['reset']}")
+        buf = io.StringIO()
+        self.visualize_gun_to(buf)
+        return buf.getvalue()[:-1]  # Drop the final newline
+    
+    def visualize_gun_to(self, out):
+        """Write the gun visualization line by line to a text stream"""
+        out.write(f"{COLORS['yellow']}Gun state: ({self.current_position + 1}/{self.chamber_count}){COLORS['reset']}\n")
         for i in range(self.chamber_count):
+            has_bullet = i in self._bullets_set
+            
             if i == self.current_position:
-                marker = f"{COLORS['red']}👉 {COLORS['reset']}"  # Pointer for current position
-            else:
-                marker = "   "
-                
-            if i in self.bullets:
-                chamber = f"{COLORS['red']}● {COLORS['reset']}"  # Bullet
+                # Pointer for current position; a bullet shares its red, so no switch is needed
+                out.write(COLORS['red'] + "👉 " + ("" if has_bullet else COLORS['cyan']))
             else:
-                chamber = f"{COLORS['cyan']}○ {COLORS['reset']}"  # Empty
-                
-            chambers.append(f"{marker}{chamber} Chamber {i+1}")
+                out.write("   " + COLORS['red' if has_bullet else 'cyan'])
             
-        return "\n".join(chambers)
+            out.write("● " if has_bullet else "○ ")  # Bullet / Empty
+            out.write(f"{COLORS['reset']} Chamber {i+1}\n")
     
     def add_player_communication(self, message: str):
         """Add player communication to both logs"""
-        self.logs.append(message)
-        self.player_logs.append(message)
+        self.add_log(LogKind.MESSAGE, None, (message,))
 
 class Player:
-    def __init__(self, name: str, role_name: str, role_style: str, llm_type: str = None):
+    def __init__(self, name: str, role_name: str, role_style: str, llm_type: str = None,
+                 llm_client: LLMClient = None, semantic_cache: bool = False):
         self.name = name
         self.llm_type = llm_type
-        self.llm_client = None if llm_type is None else create_llm_client(llm_type)
+        # The client may be shared with other players so its connections are reused
+        if llm_client is None and llm_type is not None:
+            llm_client = create_llm_client(llm_type)
+        self.llm_client = llm_client
+        # Client used to answer negotiation requests. Only these replies go through
+        # the semantic cache: turn prompts share a long fixed opening, so the
+        # embedding cannot tell one turn from the next
+        self.neg_llm_client = llm_client
+        if llm_client is not None and semantic_cache:
+            # No TTL or temperature bypass: a hit needs the exact proposal and game
+            # state of the earlier request, with only the log wording compared by
+            # similarity, so its answer still applies for models sampling at 1
+            self.neg_llm_client = SemanticCachedLLMClient(llm_client, SEMANTIC_NEG_THRESHOLD)
         self.items = []
         self.alive = True
         self.role = role_name
@@ -234,18 +357,37 @@ class Player:
         self.style = style
 
 class GameController:
-    def __init__(self, chamber_count: int = 6):
+    def __init__(self, chamber_count: int = 6, use_cache: bool = False, semantic_cache: bool = False):
         self.chamber_count = chamber_count
+        self.use_cache = use_cache  # Reuse stored LLM responses for identical prompts
+        self.semantic_cache = semantic_cache  # Also reuse negotiation replies for near-identical requests
         self.game_state = GameState(chamber_count)
         self.players = []
+        self._opponent = {}  # id(player) -> opponent, filled in by setup_game
+        self._llm_clients = {}  # One client per LLM type, shared by all players
         self.current_player_idx = 0
+        # The rules and reply format only depend on chamber_count, so build them once
+        self._rule_cached = self.get_game_rule()
+        self._reply_format_cached = self.get_reply_format()
+        self._prompt_tmpl = self.build_prompt_template()
         
     def add_player(self, name: str, role_name: str, role_style: str, llm_type: str = None):
         """Add a player with specified role, style, and LLM type"""
-        player = Player(name, role_name, role_style, llm_type)
+        llm_client = None if llm_type is None else self.get_llm_client(llm_type)
+        player = Player(name, role_name, role_style, llm_type, llm_client, self.semantic_cache)
         self.players.append(player)
         return player
     
+    def get_llm_client(self, llm_type: str) -> LLMClient:
+        """Get the shared client for an LLM type, creating it on first use"""
+        client = self._llm_clients.get(llm_type)
+        if client is None:
+            client = create_llm_client(llm_type)
+            if self.use_cache:
+                client = CachedLLMClient(client, llm_type)
+            self._llm_clients[llm_type] = client
+        return client
+    
     def setup_game(self, player_configs: List[Dict]):
         """Initialize the game with specified player configurations"""
         print_header("俄罗斯轮盘游戏开始", "green")
@@ -261,20 +403,27 @@ class GameController:
             
             self.add_player(player_name, role_name, role_style, llm_type)
         
+        # Each player faces the next one in seating order
+        n = len(self.players)
+        self._opponent = {id(p): self.players[(i + 1) % n] for i, p in enumerate(self.players)}
+        
+        # Specialize the per-turn helpers for the common two-player game
+        if n == 2:
+            self.check_contract_effect = self._check_contract_2p
+            self._next_idx = lambda idx: 1 - idx
+        
         # Initialize gun with random bullets
         self.game_state.initialize_gun()
         
         # Distribute items
-        available_items = ["子弹", "查看", "反转", "契约", "推动"] * (len(self.players) + 2)
-        random.shuffle(available_items)
+        item_pool = ["子弹", "查看", "反转", "契约", "推动"]
         
         item_count = (self.chamber_count + 2) // 3  # ceil(x/3)
         
         # Give items to players
-        for i, player in enumerate(self.players):
-            player_items = available_items[i*item_count:(i+1)*item_count]
-            for item in player_items:
-                player.add_item(item)
+        for player in self.players:
+            for _ in range(item_count):
+                player.add_item(random.choice(item_pool))
             
             print(f"{player.name} (角色: {player.role}, 风格: {player.style})")
             print(f"道具: {COLORS['cyan']}{player.get_items_string()}{COLORS['reset']}")
@@ -283,6 +432,46 @@ class GameController:
         self.current_player_idx = random.randint(0, len(self.players) - 1)
         print_event(f"{self.players[self.current_player_idx].name} 先手")
         
+    def build_prompt_template(self) -> str:
+        """Build the turn prompt as a %-template with the static parts already filled in"""
+        # Escape any literal % in the static text before it joins the template
+        rule = self._rule_cached.replace("%", "%%")
+        reply_format = self._reply_format_cached.replace("%", "%%")
+        return f"""你是:%(role_name)s
+你要以%(role_style)s的风格来进行游戏。
+你的对手是%(opponent_name)s
+
+游戏规则是：
+{rule}
+
+之前的游戏log是:
+%(logs)s
+
+当前扳机位置: %(position)d
+总弹巢数: {self.chamber_count}
+契约状态: %(contract)s
+
+你目前已经有的道具有：
+%(items)s
+
+你必须按照以下格式回复（用【】而不是<>，避免XML格式混淆）：
+
+{reply_format}
+
+请你基于你的角色设定，游戏规则，你目前有的道具，进行深刻的思考和推理，尽一切办法，做到使自己赢。如果实在不行也要尽可能平局。
+
+非常重要：交流是这个游戏中的关键元素！请务必在【交流】部分表达你的想法。
+你可以采取以下沟通策略：
+1. 欺骗战略：故意误导对手关于弹巢位置或你的意图
+2. 压制战略：试图通过展示信心让对手认为你掌握了更多信息
+3. 劝降战略：劝说对手放弃或提出对你有利的妥协方案
+4. 心理战：通过言语影响对手的判断或情绪
+
+你的沟通内容会极大地影响游戏结局，请不要沉默，积极与对手交流！
+道具的使用和你的交流相结合，能创造出极大的战术优势。
+
+请确保按照上面的格式回复，使用【】标记区域，而不是其他任何标签。"""
+    
     def get_game_rule(self) -> str:
         """Get the formatted game rule with actual chamber count"""
         rule = f"""游戏规则：
@@ -319,9 +508,8 @@ class GameController:
         result = {}
         
         # Extract item usage
-        item_match = re.search(r'【道具】\s*(.*?)\s*【道具结束】', response, re.DOTALL)
-        if item_match:
-            item_text = item_match.group(1).strip()
+        item_text = _between(response, "【道具】", "【道具结束】")
+        if item_text is not None:
             if "不使用" in item_text:
                 result["item"] = None
                 result["item_param"] = None
@@ -333,9 +521,8 @@ class GameController:
                 result["item_param"] = item_parts[1] if len(item_parts) > 1 else None
         
         # Extract communication
-        comm_match = re.search(r'【交流】\s*(.*?)\s*【交流结束】', response, re.DOTALL)
-        if comm_match:
-            comm_text = comm_match.group(1).strip()
+        comm_text = _between(response, "【交流】", "【交流结束】")
+        if comm_text is not None:
             if "沉默" in comm_text:
                 result["communication"] = "沉默"
                 result["message"] = None
@@ -350,9 +537,8 @@ class GameController:
                 result["message"] = parts[1] if len(parts) > 1 else ""
         
         # Extract firing decision
-        fire_match = re.search(r'【开火】\s*(.*?)\s*【开火结束】', response, re.DOTALL)
-        if fire_match:
-            fire_text = fire_match.group(1).strip()
+        fire_text = _between(response, "【开火】", "【开火结束】")
+        if fire_text is not None:
             result["target"] = "自己" if "自己" in fire_text else "对面"
         
         return result
@@ -396,20 +582,23 @@ class GameController:
             player.remove_item("推动")
             spec_message = player_message = self.game_state.move_position()
         
-        # Add to spectator logs
-        self.game_state.logs.append(f"{player.name} 使用了 {item}：{spec_message}")
-        
-        # Add to player logs (with potentially less information)
-        self.game_state.player_logs.append(f"{player.name} 使用了 {item}")
+        # Spectators see the full result, players only see which item was used
+        self.game_state.add_log(LogKind.ITEM, player.name, (item, spec_message))
         
         return player_message
     
+    def apply_item_choice(self, player: Player, parsed: Dict) -> str:
+        """Apply the item part of a parsed response and return the event text"""
+        if parsed.get("item"):
+            result = self.handle_item_usage(player, parsed["item"], parsed.get("item_param"))
+            return f"{player.name} 使用道具 {parsed['item']}: {result}"
+        return f"{player.name} 选择不使用道具"
+    
     def get_opponent(self, player):
         """Get the player's opponent"""
-        player_idx = self.players.index(player)
-        return self.players[(player_idx + 1) % len(self.players)]
+        return self._opponent[id(player)]
     
-    def process_player_turn(self, player_idx) -> bool:
+    async def process_player_turn(self, player_idx) -> bool:
         """Process a player's turn, return True if game should continue"""
         player = self.players[player_idx]
         opponent = self.get_opponent(player)
@@ -422,7 +611,7 @@ class GameController:
         # For spectators only: visualization of gun state
         if DEBUG:
             print_debug("当前枪械状态 (仅观众可见)")
-            print(self.game_state.visualize_gun())
+            self.game_state.visualize_gun_to(sys.stdout)
             print_debug("玩家道具: " + player.get_items_string())
         
         # Skip if player is not AI
@@ -432,41 +621,16 @@ class GameController:
         # Create a Role object for this player
         role = Role(player.role, player.style)
         
-        # Prepare the prompt for AI with improved format
-        prompt = f"""你是:{role.name}
-你要以{role.style}的风格来进行游戏。
-你的对手是{opponent.name}
-
-游戏规则是：
-{self.get_game_rule()}
-
-之前的游戏log是:
-{self.game_state.get_status(for_player=True)}
-
-当前扳机位置: {self.game_state.current_position + 1}
-总弹巢数: {self.chamber_count}
-契约状态: {'激活' if self.game_state.contract_active else '未激活'}
-
-你目前已经有的道具有：
-{player.get_items_string()}
-
-你必须按照以下格式回复（用【】而不是<>，避免XML格式混淆）：
-
-{self.get_reply_format()}
-
-请你基于你的角色设定，游戏规则，你目前有的道具，进行深刻的思考和推理，尽一切办法，做到使自己赢。如果实在不行也要尽可能平局。
-
-非常重要：交流是这个游戏中的关键元素！请务必在【交流】部分表达你的想法。
-你可以采取以下沟通策略：
-1. 欺骗战略：故意误导对手关于弹巢位置或你的意图
-2. 压制战略：试图通过展示信心让对手认为你掌握了更多信息
-3. 劝降战略：劝说对手放弃或提出对你有利的妥协方案
-4. 心理战：通过言语影响对手的判断或情绪
-
-你的沟通内容会极大地影响游戏结局，请不要沉默，积极与对手交流！
-道具的使用和你的交流相结合，能创造出极大的战术优势。
-
-请确保按照上面的格式回复，使用【】标记区域，而不是其他任何标签。"""
+        # Fill the per-turn fields into the prepared prompt template
+        prompt = self._prompt_tmpl % {
+            "role_name": role.name,
+            "role_style": role.style,
+            "opponent_name": opponent.name,
+            "logs": self.game_state.get_status(for_player=True),
+            "position": self.game_state.current_position + 1,
+            "contract": '激活' if self.game_state.contract_active else '未激活',
+            "items": player.get_items_string(),
+        }
 
         messages = [{"role": "user", "content": prompt}]
         
@@ -476,16 +640,22 @@ class GameController:
             print(prompt)
             print_divider("-", 40)
         
-        # Send message to LLM
+        # Send message to LLM and print the response as it streams in
         print_event(f"{player.name} 思考中...")
         start_time = time.time()
-        ai_response = player.llm_client.send_message(messages)
+        print_header(f"{player.name} 回应", "cyan")
+        ai_response = ""
+        item_event = None
+        async for chunk in player.llm_client.stream_message_async(messages):
+            sys.stdout.write(chunk)
+            sys.stdout.flush()
+            ai_response += chunk
+            # The item section comes first, so apply it while the rest is still generating
+            if item_event is None and "【道具结束】" in ai_response:
+                item_event = self.apply_item_choice(player, self.parse_response(ai_response))
         end_time = time.time()
+        print()
         print(f"思考用时: {COLORS['yellow']}{end_time - start_time:.2f}秒{COLORS['reset']}")
-        
-        # Print AI response with clear formatting
-        print_header(f"{player.name} 回应", "cyan")
-        print(ai_response)
         print_divider("-")
         
         # Parse response
@@ -495,11 +665,9 @@ class GameController:
         
         # Process the player's actions
         # 1. Item usage
-        if parsed.get("item"):
-            result = self.handle_item_usage(player, parsed["item"], parsed.get("item_param"))
-            print_event(f"{player.name} 使用道具 {parsed['item']}: {result}")
-        else:
-            print_event(f"{player.name} 选择不使用道具")
+        if item_event is None:
+            item_event = self.apply_item_choice(player, parsed)
+        print_event(item_event)
         
         # 2. Communication
         if parsed.get("communication") == "协商":
@@ -509,18 +677,19 @@ class GameController:
             self.game_state.add_player_communication(f"{player.name} 提出协商: {message}")
             
             # Create a prompt for the opponent to consider the negotiation
-            neg_prompt = self.get_neg_prompt(player, opponent, message)
-
-            neg_messages = [{"role": "user", "content": neg_prompt}]
+            neg_messages = self.get_neg_messages(player, opponent, message)
+            # Dispatch the opponent's request right away so its round trip
+            # overlaps with the local printing below
+            neg_task = asyncio.create_task(opponent.neg_llm_client.send_message_async(neg_messages, max_tokens=NEG_MAX_TOKENS))
             
             if DEBUG:
                 print_debug("协商考虑中的Prompt内容:")
                 print_divider("-", 40)
-                print(neg_prompt)
+                print("\n\n".join(m["content"] for m in neg_messages))
                 print_divider("-", 40)
             
             print_event(f"等待 {opponent.name} 考虑协商请求...")
-            opponent_response = opponent.llm_client.send_message(neg_messages)
+            opponent_response = await neg_task
             print_header(f"{opponent.name} 回应", "cyan")
             print(opponent_response)
             print_divider("-")
@@ -578,10 +747,22 @@ class GameController:
         # Show updated gun state after turn if debugging
         if DEBUG:
             print_debug("回合结束后枪械状态:")
-            print(self.game_state.visualize_gun())
+            self.game_state.visualize_gun_to(sys.stdout)
         
         return True
     
+    def _next_idx(self, idx: int) -> int:
+        """Index of the player who moves after player idx"""
+        return (idx + 1) % len(self.players)
+    
+    def _check_contract_2p(self) -> bool:
+        """check_contract_effect for exactly two players"""
+        if self.game_state.contract_active and not (self.players[0].alive and self.players[1].alive):
+            print("契约效果触发! 所有玩家同归于尽!")
+            self.players[0].alive = self.players[1].alive = False
+            return False
+        return True
+    
     def check_contract_effect(self) -> bool:
         """Check and apply contract effect if needed, return True if game should continue"""
         if self.game_state.contract_active:
@@ -595,6 +776,17 @@ class GameController:
     
     def run_game(self):
         """Run the game loop"""
+        async def run():
+            try:
+                await self.run_game_async()
+            finally:
+                # The connection pool belongs to this event loop
+                await close_async_clients()
+        
+        asyncio.run(run())
+    
+    async def run_game_async(self):
+        """Run the game loop inside an event loop"""
         game_active = True
         max_turns = 30  # Safety measure to prevent infinite loops
         turn_count = 0
@@ -606,7 +798,7 @@ class GameController:
             print_divider("=")
             print_header(f"第 {turn_count + 1} 回合", "white")
             
-            game_active = self.process_player_turn(player_idx)
+            game_active = await self.process_player_turn(player_idx)
             
             # If a player was hit, check contract but game will end
             if not game_active:
@@ -616,7 +808,7 @@ class GameController:
                 break
             
             # Switch to next player
-            self.current_player_idx = (self.current_player_idx + 1) % len(self.players)
+            self.current_player_idx = self._next_idx(self.current_player_idx)
             turn_count += 1
         
         print_header("游戏结束", "green", width=80)
@@ -643,28 +835,44 @@ class GameController:
         
         # Final visualization of the gun
         print_header("最终枪械状态", "yellow")
-        print(self.game_state.visualize_gun())
+        self.game_state.visualize_gun_to(sys.stdout)
 
-    def get_neg_prompt(self, player, opponent, message):
-        """Generate a negotiation prompt for the opponent"""
-        return f"""你是:{opponent.role}
+    def get_neg_messages(self, player, opponent, message):
+        """Generate the negotiation request for the opponent
+        
+        The proposal and the decisive game state go in the system message and
+        the log in the user message: with the semantic cache on, the system
+        message must match exactly and only the log is compared by similarity.
+        """
+        # Ends in a blank line, for clients that fold the system text into the user turn
+        terms = f"""你是:{opponent.role}
 你要以{opponent.style}的风格来进行游戏。
 当前游戏中，对手 {player.name} 提出了协商平局的请求。
 
 具体协商内容: "{message}"
 
-当前游戏状态:
-{self.game_state.get_status(for_player=True)}
-
 当前扳机位置: {self.game_state.current_position + 1}/{self.chamber_count}
 契约状态: {'激活' if self.game_state.contract_active else '未激活'}
 
 你的道具: {opponent.get_items_string()}
 
+"""
+        state = f"""当前游戏状态:
+{self.game_state.get_status(for_player=True)}
+
 请考虑当前游戏状态、你的性格和胜率，你会同意这个协商吗？
 请只回复"同意"或"拒绝"以及简短的理由。"""
+        return [
+            {"role": "system", "content": terms},
+            {"role": "user", "content": state},
+        ]
 
 def main():
+    parser = argparse.ArgumentParser(description="俄罗斯轮盘对决")
+    parser.add_argument("--cache", action="store_true", help="复用本地缓存的LLM响应 (相同的Prompt会重放同一条回复)")
+    parser.add_argument("--semantic-cache", action="store_true", help="对相似的协商请求复用已有回复 (需要 faiss-cpu 和 sentence-transformers)")
+    args = parser.parse_args()
+    
     # Game configuration
     game_config = {
         "chamber_count": 6,  # Number of chambers in the gun
@@ -689,11 +897,12 @@ def main():
     
     # Print game banner
     print_divider("=")
-    print(f"{COLORS['bold']}{COLORS['red']}俄罗斯轮盘对决{COLORS['reset']}")
+    print(f"{sgr('bold', 'red')}俄罗斯轮盘对决{COLORS['reset']}")
     print_divider("=")
     
     # Initialize and run the game
-    game = GameController(chamber_count=game_config["chamber_count"])
+    game = GameController(chamber_count=game_config["chamber_count"], use_cache=args.cache,
+                          semantic_cache=args.semantic_cache)
     game.setup_game(game_config["player_configs"])
     game.run_game()
 
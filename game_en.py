@@ -1,12 +1,65 @@
+import argparse
+import asyncio
+import gzip
+import io
+import logging
 import random
-import re
+import sys
 import time
 import os
+from collections import deque
+from functools import lru_cache
 from typing import List, Dict, Optional
-from llm_client import create_llm_client
 
 # Debug settings
 DEBUG = True  # Set to True for debugging output
+# Reply cap for negotiation answers ("Agree"/"Decline" and a short reason)
+NEG_MAX_TOKENS = 128
+
+def _between(text, open_tok, close_tok):
+    """Return the stripped text between two markers, or None if either is missing"""
+    start = text.find(open_tok)
+    if start < 0:
+        return None
+    start += len(open_tok)
+    end = text.find(close_tok, start)
+    if end < 0:
+        return None
+    return text[start:end].strip()
+
+# Strategy guidance shared by every turn prompt
+_STRATEGY_TEXT = """Very important: Communication is a key element in this game! Please express your thoughts in the 【communication】 section.
+You can use these communication strategies:
+1. Deception strategy: Deliberately mislead your opponent about chamber positions or your intentions
+2. Pressure strategy: Try to make your opponent believe you have more information by showing confidence
+3. Surrender strategy: Persuade your opponent to give up or propose a compromise that benefits you
+4. Psychological warfare: Use words to influence your opponent's judgment or emotions
+
+Your communication will greatly influence the game outcome, don't stay silent, actively engage with your opponent!
+Combining item use with effective communication can create significant tactical advantages."""
+
+# Game state as seen by one player, shared by the turn and negotiation prompts
+_CONTEXT_TEMPLATE = """Previous game logs:
+{logs}
+
+Current trigger position: {position}
+Total chambers: {chamber_count}
+Contract status: {contract}
+
+Your current items:
+{items}"""
+
+# Per-turn part of the prompt, filled in with str.format_map
+_TURN_TEMPLATE = """You are: {role_name}
+You should play the game in the style of {role_style}.
+Your opponent is {opponent_name}
+
+{context}
+
+Please think deeply and reason based on your role, the game rules, and your available items, doing everything possible to win. If winning isn't possible, aim for a draw.
+
+Make sure to reply in the exact format above, using 【】 markers for sections, not any other tags."""
+
 # ANSI color codes for better visibility
 COLORS = {
     "reset": "\033[0m",
@@ -21,79 +74,194 @@ COLORS = {
     "underline": "\033[4m"
 }
 
-# Check if we're in Windows CMD (which needs colorama for ANSI codes)
-if os.name == 'nt':
-    try:
-        import colorama
-        colorama.init()
-    except ImportError:
-        # If colorama is not available, disable colors
-        for key in COLORS:
-            COLORS[key] = ""
+_color_initialized = False
+
+def _ensure_color_init():
+    """Set up ANSI support on first use (Windows CMD needs colorama for ANSI codes)"""
+    global _color_initialized
+    if _color_initialized:
+        return
+    _color_initialized = True
+    if os.name == 'nt':
+        try:
+            import colorama
+            colorama.init()
+        except ImportError:
+            # If colorama is not available, disable colors
+            for key in COLORS:
+                COLORS[key] = ""
+
+# Escape codes are just noise when output is redirected to a file or pipe
+if not sys.stdout.isatty():
+    for key in COLORS:
+        COLORS[key] = ""
+
+class _ColorFormatter(logging.Formatter):
+    """Render log records the way the print helpers used to: colored, with a level marker"""
+    STYLES = {
+        logging.DEBUG: ("blue", "[DEBUG] "),
+        logging.INFO: ("green", "➤ "),
+        logging.WARNING: ("red", "⚠ "),
+    }
+    
+    def format(self, record):
+        color, prefix = self.STYLES.get(record.levelno, ("red", "⚠ "))
+        return f"{COLORS[color]}{prefix}{record.getMessage()}{COLORS['reset']}"
+
+class _StdoutHandler(logging.StreamHandler):
+    """Write to whatever sys.stdout is when the record is emitted
+    
+    Looking the stream up each time keeps log output together with print()
+    when stdout is redirected or wrapped (e.g. by colorama) after import.
+    """
+    
+    @property
+    def stream(self):
+        return sys.stdout
+    
+    @stream.setter
+    def stream(self, value):
+        pass
+
+# Game events and debug output go through logging, so debug messages cost nothing below the threshold
+log = logging.getLogger("rr")
+_log_handler = _StdoutHandler()
+_log_handler.setFormatter(_ColorFormatter())
+log.addHandler(_log_handler)
+log.setLevel(logging.DEBUG if DEBUG else logging.INFO)
+log.propagate = False
 
 def print_header(text, color="yellow", width=80):
     """Print a centered header with a colored background"""
     print(f"\n{COLORS[color]}{COLORS['bold']}{text.center(width)}{COLORS['reset']}\n")
-    
-def print_debug(text):
-    """Print debug information if DEBUG is enabled"""
-    if DEBUG:
-        print(f"{COLORS['blue']}[DEBUG] {text}{COLORS['reset']}")
 
 def print_event(text):
     """Print game event information"""
-    print(f"{COLORS['green']}➤ {text}{COLORS['reset']}")
+    log.info(text)
 
 def print_warning(text):
     """Print warning information"""
-    print(f"{COLORS['red']}⚠ {text}{COLORS['reset']}")
+    log.warning(text)
 
 def print_divider(char="=", width=80):
     """Print a divider line"""
     print(char * width)
 
+@lru_cache(maxsize=1)
+def _game_rule(chamber_count: int) -> str:
+    """Game rule text for a given chamber count"""
+    return f"""Game Rules:
+There is a revolver with {chamber_count} chambers, and 1~{chamber_count//2} bullets randomly loaded.
+The game will randomly select a player to start. Each player can choose to shoot themselves or the other player.
+Before shooting, players can optionally perform two actions: choose whether to use an item (the opponent can only see if an item was used, but not which one, except for Contract) -> choose whether to speak to the other player, dialog can be used for negotiation, if the opponent agrees then the game ends in a draw -> acknowledge the current trigger position, and choose to shoot yourself or the other player.
+Item rules: Each player will randomly receive ceil(x/3) items at the start. The items and their functions are:
+1. Bullet: Adds an extra bullet to a random empty chamber
+2. Check: Choose a chamber position to inspect, and be told if it contains a bullet or is empty
+3. Reverse: The opponent's next action will be reversed
+4. Contract: For the next 3 turns, if one player is shot, the other is also shot, resulting in a draw
+5. Push: Advance the trigger position by one chamber"""
+
+def _has_bullet(bullets: int, position: int) -> bool:
+    """Whether the bullet mask has a bullet at position"""
+    return (bullets >> position) & 1 == 1
+
+def _next_position(position: int, chamber_count: int) -> int:
+    """Trigger position after advancing one chamber"""
+    position += 1
+    return position if position < chamber_count else 0
+
+def _nth_set_bit(mask: int, k: int) -> int:
+    """Index of the k-th (0-based) set bit of mask, counting from the lowest"""
+    for _ in range(k):
+        mask &= mask - 1  # Clear the lowest set bit
+    return (mask & -mask).bit_length() - 1
+
 class Role:
+    __slots__ = ("name", "style")
+    
     def __init__(self, name: str, style: str):
         self.name = name
         self.style = style
 
 class GameState:
-    def __init__(self, chamber_count: int):
+    __slots__ = ("chamber_count", "_rng", "bullets", "current_position", "_log_buf",
+                 "_player_log_head", "_player_logs", "_player_log_count",
+                 "contract_active", "contract_turns_left", "reverse_active", "reset_reverse",
+                 "last_active_player", "_gun_rows")
+    
+    def __init__(self, chamber_count: int, rng: Optional[random.Random] = None):
         self.chamber_count = chamber_count
-        self.bullets = []
+        self._rng = rng if rng is not None else random.Random()  # Own generator so a seeded game can be replayed
+        self.bullets = 0  # Bitmask: bit i is set when chamber i holds a bullet
         self.current_position = 0
-        self.logs = []  # Full logs with all information (for spectators)
-        self.player_logs = []  # Limited logs for players (no bullet positions)
+        # The spectator log is kept pre-joined so get_status does not rebuild it every turn
+        self._log_buf = io.StringIO()  # Full logs with all information (for spectators)
+        # Limited logs for players (no bullet positions). Only the opening entry and the most
+        # recent ones are kept, so prompt size stays bounded however long the game runs
+        self._player_log_head = None
+        self._player_logs = deque(maxlen=chamber_count * 4)
+        self._player_log_count = 0
         self.contract_active = False
         self.contract_turns_left = 0
         self.reverse_active = False
+        self.reset_reverse = False  # Set once a reversed shot has used up the effect
         self.last_active_player = None
+        # Row templates for visualize_gun, indexed by (is current position, has bullet)
+        pointer = f"{COLORS['red']}👉 {COLORS['reset']}"
+        bullet = f"{COLORS['red']}● {COLORS['reset']}"
+        empty = f"{COLORS['cyan']}○ {COLORS['reset']}"
+        self._gun_rows = {
+            (False, False): f"   {empty} Chamber %d",
+            (False, True): f"   {bullet} Chamber %d",
+            (True, False): f"{pointer}{empty} Chamber %d",
+            (True, True): f"{pointer}{bullet} Chamber %d",
+        }
+    
+    @property
+    def bullet_positions(self) -> List[int]:
+        """Sorted list of chamber positions holding a bullet"""
+        return [i for i in range(self.chamber_count) if self.bullets & (1 << i)]
+    
+    def add_log(self, message: str):
+        """Add a line to the spectator log"""
+        if self._log_buf.tell():
+            self._log_buf.write("\n")
+        self._log_buf.write(message)
+    
+    def add_player_log(self, message: str):
+        """Add a line to the player-visible log"""
+        if self._player_log_head is None:
+            self._player_log_head = message  # Holds the bullet count, so it is never dropped
+        else:
+            self._player_logs.append(message)
+        self._player_log_count += 1
     
     def initialize_gun(self):
         # Randomly place 1 to floor(x/2) bullets
-        bullet_count = random.randint(1, self.chamber_count // 3)
+        bullet_count = self._rng.randint(1, self.chamber_count // 3)
         all_positions = list(range(self.chamber_count))
-        random.shuffle(all_positions)
-        self.bullets = sorted(all_positions[:bullet_count])  # Sort for better readability
-        self.current_position = random.randint(0, self.chamber_count - 1)
+        self._rng.shuffle(all_positions)
+        self.bullets = 0
+        for pos in all_positions[:bullet_count]:
+            self.bullets |= 1 << pos
+        self.current_position = self._rng.randint(0, self.chamber_count - 1)
         
         # Log for spectators with bullet positions
-        self.logs.append(f"Game initialized: {bullet_count} bullets randomly loaded at positions {[pos+1 for pos in self.bullets]}, initial trigger position is {self.current_position + 1}")
+        self.add_log(f"Game initialized: {bullet_count} bullets randomly loaded at positions {[pos+1 for pos in self.bullet_positions]}, initial trigger position is {self.current_position + 1}")
         
         # Log for players without bullet positions
-        self.player_logs.append(f"Game initialized: {bullet_count} bullets randomly loaded, initial trigger position is {self.current_position + 1}")
+        self.add_player_log(f"Game initialized: {bullet_count} bullets randomly loaded, initial trigger position is {self.current_position + 1}")
         
         # Debug output for bullet positions
-        if DEBUG:
-            print_debug(f"Bullets placed at positions: {[pos+1 for pos in self.bullets]}")
+        log.debug("Bullets placed at positions: %s", [pos+1 for pos in self.bullet_positions])
     
     def add_bullet(self):
         # Find empty chambers
-        empty_chambers = [i for i in range(self.chamber_count) if i not in self.bullets]
-        if empty_chambers:
-            new_bullet = random.choice(empty_chambers)
-            self.bullets.append(new_bullet)
-            self.bullets.sort()  # Keep sorted for easier debugging
+        empty_mask = ((1 << self.chamber_count) - 1) & ~self.bullets
+        if empty_mask:
+            empty_count = bin(empty_mask).count("1")
+            new_bullet = _nth_set_bit(empty_mask, self._rng.randrange(empty_count))
+            self.bullets |= 1 << new_bullet
             
             # Different logs for spectators vs players
             spec_msg = f"Bullet added to position {new_bullet+1}"
@@ -110,19 +278,19 @@ class GameState:
         if position < 0 or position >= self.chamber_count:
             raise ValueError(f"Position must be between 0 and {self.chamber_count-1}")
         
-        has_bullet = position in self.bullets
+        has_bullet = _has_bullet(self.bullets, position)
         
         # Log for spectators
-        self.logs.append(f"{player_name} checks position {position+1}: {'has bullet' if has_bullet else 'empty chamber'}")
+        self.add_log(f"{player_name} checks position {position+1}: {'has bullet' if has_bullet else 'empty chamber'}")
         
         # For players, this info is directly returned to the checking player
-        # but not added to player_logs to avoid leaking information
+        # but not added to the player log to avoid leaking information
         
         return has_bullet
     
     def move_position(self):
         """Move the current position by 1"""
-        self.current_position = (self.current_position + 1) % self.chamber_count
+        self.current_position = _next_position(self.current_position, self.chamber_count)
         
         # Same message for both spectators and players
         msg = f"Trigger moved to position {self.current_position+1}"
@@ -147,24 +315,23 @@ class GameState:
 
     def fire(self) -> bool:
         """Fire the gun at current position and return True if it was a bullet"""
-        was_bullet = self.current_position in self.bullets
-        
-        # Log for spectators with full information
-        self.logs.append(f"Fired at position {self.current_position+1}, result: {'hit' if was_bullet else 'empty'}")
+        was_bullet = _has_bullet(self.bullets, self.current_position)
         
-        # Log for players with same information (result is publicly visible)
-        self.player_logs.append(f"Fired at position {self.current_position+1}, result: {'hit' if was_bullet else 'empty'}")
+        # Spectators and players get the same line (result is publicly visible)
+        msg = f"Fired at position {self.current_position+1}, result: {'hit' if was_bullet else 'empty'}"
+        self.add_log(msg)
+        self.add_player_log(msg)
         
         # Move to next chamber after firing
-        self.current_position = (self.current_position + 1) % self.chamber_count
+        self.current_position = _next_position(self.current_position, self.chamber_count)
         
         # Update contract turns
         if self.contract_active:
             self.contract_turns_left -= 1
             if self.contract_turns_left <= 0:
                 self.contract_active = False
-                self.logs.append("Contract effect has ended")
-                self.player_logs.append("Contract effect has ended")
+                self.add_log("Contract effect has ended")
+                self.add_player_log("Contract effect has ended")
         
         return was_bullet
     
@@ -174,41 +341,47 @@ class GameState:
         Args:
             for_player: If True, return limited logs for players
         """
-        logs_to_use = self.player_logs if for_player else self.logs
-        if not logs_to_use:
+        if for_player:
+            if self._player_log_head is None:
+                return "Game just started"
+            lines = [self._player_log_head]
+            omitted = self._player_log_count - 1 - len(self._player_logs)
+            if omitted:
+                lines.append("[%d earlier entries omitted]" % omitted)
+            lines.extend(self._player_logs)
+            return "\n".join(lines)
+        if not self._log_buf.tell():
             return "Game just started"
-        return "\n".join(logs_to_use)
+        return self._log_buf.getvalue()
     
     def visualize_gun(self) -> str:
         """Visualize the current state of the gun for spectators"""
-        chambers = []
-        chambers.append(f"{COLORS['yellow']}Gun state: ({self.current_position + 1}/{self.chamber_count}){COLORS['reset']}")
-        for i in range(self.chamber_count):
-            if i == self.current_position:
-                marker = f"{COLORS['red']}👉 {COLORS['reset']}"  # Pointer for current position
-            else:
-                marker = "   "
-                
-            if i in self.bullets:
-                chamber = f"{COLORS['red']}● {COLORS['reset']}"  # Bullet
-            else:
-                chamber = f"{COLORS['cyan']}○ {COLORS['reset']}"  # Empty
-                
-            chambers.append(f"{marker}{chamber} Chamber {i+1}")
-            
+        rows = self._gun_rows
+        chambers = [f"{COLORS['yellow']}Gun state: ({self.current_position + 1}/{self.chamber_count}){COLORS['reset']}"]
+        chambers += [rows[i == self.current_position, _has_bullet(self.bullets, i)] % (i + 1)
+                     for i in range(self.chamber_count)]
         return "\n".join(chambers)
     
     def add_player_communication(self, message: str):
         """Add player communication to both logs"""
-        self.logs.append(message)
-        self.player_logs.append(message)
+        self.add_log(message)
+        self.add_player_log(message)
 
 class Player:
-    def __init__(self, name: str, role_name: str, role_style: str, llm_type: str = None):
+    __slots__ = ("name", "llm_type", "llm_client", "items", "idx", "alive", "role", "style")
+    
+    def __init__(self, name: str, role_name: str, role_style: str, llm_type: str = None, use_cache: bool = False):
         self.name = name
         self.llm_type = llm_type
-        self.llm_client = None if llm_type is None else create_llm_client(llm_type)
+        self.llm_client = None
+        if llm_type is not None:
+            # Imported here so the provider SDKs only load once a client is actually needed
+            from llm_client import create_llm_client, CachedLLMClient
+            self.llm_client = create_llm_client(llm_type)
+            if use_cache:
+                self.llm_client = CachedLLMClient(self.llm_client, llm_type)
         self.items = []
+        self.idx = 0  # Seat index, assigned by GameController.add_player
         self.alive = True
         self.role = role_name
         self.style = role_style
@@ -234,15 +407,30 @@ class Player:
         self.style = style
 
 class GameController:
-    def __init__(self, chamber_count: int = 6):
+    def __init__(self, chamber_count: int = 6, use_cache: bool = False, seed: Optional[int] = None):
         self.chamber_count = chamber_count
-        self.game_state = GameState(chamber_count)
+        self.use_cache = use_cache  # Reuse stored LLM responses for identical prompts
+        self._rng = random.Random(seed)  # Shared with the game state so a seed fixes the whole setup
+        self.game_state = GameState(chamber_count, self._rng)
         self.players = []
         self.current_player_idx = 0
+        # The static part of the turn prompt is the same every turn, so build it once
+        self._prompt_prefix = (
+            f"Game rules:\n{self.get_game_rule()}\n\n"
+            "You must reply in the following format (use 【】 instead of <>, to avoid XML format confusion):\n\n"
+            f"{self.get_reply_format()}\n\n"
+            f"{_STRATEGY_TEXT}\n\n"
+        )
+        # Marks the prefix for providers with prompt caching. At about 570 tokens it
+        # is below the 1,024-token minimum OpenAI and Anthropic cache, so with the
+        # current rules it gets no cache hits; the key only takes effect if the
+        # static prefix grows past that
+        self._prompt_prefix_key = f"rr-en-rules-{chamber_count}"
         
     def add_player(self, name: str, role_name: str, role_style: str, llm_type: str = None):
         """Add a player with specified role, style, and LLM type"""
-        player = Player(name, role_name, role_style, llm_type)
+        player = Player(name, role_name, role_style, llm_type, self.use_cache)
+        player.idx = len(self.players)
         self.players.append(player)
         return player
     
@@ -266,7 +454,7 @@ class GameController:
         
         # Distribute items
         available_items = ["Bullet", "Check", "Reverse", "Contract", "Push"] * (len(self.players) + 2)
-        random.shuffle(available_items)
+        self._rng.shuffle(available_items)
         
         item_count = (self.chamber_count + 2) // 3  # ceil(x/3)
         
@@ -280,22 +468,12 @@ class GameController:
             print(f"Items: {COLORS['cyan']}{player.get_items_string()}{COLORS['reset']}")
         
         # Randomly determine who goes first
-        self.current_player_idx = random.randint(0, len(self.players) - 1)
+        self.current_player_idx = self._rng.randint(0, len(self.players) - 1)
         print_event(f"{self.players[self.current_player_idx].name} goes first")
         
     def get_game_rule(self) -> str:
         """Get the formatted game rule with actual chamber count"""
-        rule = f"""Game Rules:
-There is a revolver with {self.chamber_count} chambers, and 1~{self.chamber_count//2} bullets randomly loaded.
-The game will randomly select a player to start. Each player can choose to shoot themselves or the other player.
-Before shooting, players can optionally perform two actions: choose whether to use an item (the opponent can only see if an item was used, but not which one, except for Contract) -> choose whether to speak to the other player, dialog can be used for negotiation, if the opponent agrees then the game ends in a draw -> acknowledge the current trigger position, and choose to shoot yourself or the other player.
-Item rules: Each player will randomly receive ceil(x/3) items at the start. The items and their functions are:
-1. Bullet: Adds an extra bullet to a random empty chamber
-2. Check: Choose a chamber position to inspect, and be told if it contains a bullet or is empty
-3. Reverse: The opponent's next action will be reversed
-4. Contract: For the next 3 turns, if one player is shot, the other is also shot, resulting in a draw
-5. Push: Advance the trigger position by one chamber"""
-        return rule
+        return _game_rule(self.chamber_count)
     
     def get_reply_format(self) -> str:
         """Get the required reply format"""
@@ -319,9 +497,8 @@ Choose: Self or Opponent
         result = {}
         
         # Extract item usage
-        item_match = re.search(r'【item】\s*(.*?)\s*【item end】', response, re.DOTALL)
-        if item_match:
-            item_text = item_match.group(1).strip()
+        item_text = _between(response, "【item】", "【item end】")
+        if item_text is not None:
             if "None" in item_text:
                 result["item"] = None
                 result["item_param"] = None
@@ -333,9 +510,8 @@ Choose: Self or Opponent
                 result["item_param"] = item_parts[1] if len(item_parts) > 1 else None
         
         # Extract communication
-        comm_match = re.search(r'【communication】\s*(.*?)\s*【communication end】', response, re.DOTALL)
-        if comm_match:
-            comm_text = comm_match.group(1).strip()
+        comm_text = _between(response, "【communication】", "【communication end】")
+        if comm_text is not None:
             if "Silent" in comm_text:
                 result["communication"] = "Silent"
                 result["message"] = None
@@ -350,9 +526,8 @@ Choose: Self or Opponent
                 result["message"] = parts[1] if len(parts) > 1 else ""
         
         # Extract firing decision
-        fire_match = re.search(r'【fire】\s*(.*?)\s*【fire end】', response, re.DOTALL)
-        if fire_match:
-            fire_text = fire_match.group(1).strip()
+        fire_text = _between(response, "【fire】", "【fire end】")
+        if fire_text is not None:
             result["target"] = "Self" if "Self" in fire_text else "Opponent"
         
         return result
@@ -397,19 +572,39 @@ Choose: Self or Opponent
             spec_message = player_message = self.game_state.move_position()
         
         # Add to spectator logs
-        self.game_state.logs.append(f"{player.name} used {item}: {spec_message}")
+        self.game_state.add_log(f"{player.name} used {item}: {spec_message}")
         
         # Add to player logs (with potentially less information)
-        self.game_state.player_logs.append(f"{player.name} used {item}")
+        self.game_state.add_player_log(f"{player.name} used {item}")
         
         return player_message
     
+    def apply_item_choice(self, player: Player, parsed: Dict) -> str:
+        """Apply the item part of a parsed response and return the event text"""
+        if parsed.get("item"):
+            result = self.handle_item_usage(player, parsed["item"], parsed.get("item_param"))
+            return f"{player.name} uses item {parsed['item']}: {result}"
+        return f"{player.name} chooses not to use an item"
+    
+    def start_negotiation(self, player: Player, opponent: Player, message: str):
+        """Log a negotiation proposal and send it to the opponent
+        
+        Returns:
+            tuple: The negotiation prompt and the task awaiting the opponent's reply
+        """
+        # Add to both logs
+        self.game_state.add_player_communication(f"{player.name} proposes negotiation: {message}")
+        
+        # Create a prompt for the opponent to consider the negotiation
+        neg_prompt = self.get_neg_prompt(player, opponent, message)
+        neg_messages = [{"role": "user", "content": neg_prompt}]
+        return neg_prompt, asyncio.create_task(opponent.llm_client.send_message_async(neg_messages, max_tokens=NEG_MAX_TOKENS))
+    
     def get_opponent(self, player):
         """Get the player's opponent"""
-        player_idx = self.players.index(player)
-        return self.players[(player_idx + 1) % len(self.players)]
+        return self.players[(player.idx + 1) % len(self.players)]
     
-    def process_player_turn(self, player_idx) -> bool:
+    async def process_player_turn(self, player_idx) -> bool:
         """Process a player's turn, return True if game should continue"""
         player = self.players[player_idx]
         opponent = self.get_opponent(player)
@@ -420,10 +615,10 @@ Choose: Self or Opponent
         print(f"Contract status: {'Active' if self.game_state.contract_active else 'Inactive'}")
         
         # For spectators only: visualization of gun state
-        if DEBUG:
-            print_debug("Current gun state (spectators only)")
+        if log.isEnabledFor(logging.DEBUG):
+            log.debug("Current gun state (spectators only)")
             print(self.game_state.visualize_gun())
-            print_debug("Player items: " + player.get_items_string())
+            log.debug("Player items: %s", player.get_items_string())
         
         # Skip if player is not AI
         if player.llm_client is None:
@@ -432,95 +627,76 @@ Choose: Self or Opponent
         # Create a Role object for this player
         role = Role(player.role, player.style)
         
-        # Prepare the prompt for AI with improved format
-        prompt = f"""You are: {role.name}
-You should play the game in the style of {role.style}.
-Your opponent is {opponent.name}
-
-Game rules:
-{self.get_game_rule()}
-
-Previous game logs:
-{self.game_state.get_status(for_player=True)}
-
-Current trigger position: {self.game_state.current_position + 1}
-Total chambers: {self.chamber_count}
-Contract status: {'Active' if self.game_state.contract_active else 'Inactive'}
-
-Your current items:
-{player.get_items_string()}
-
-You must reply in the following format (use 【】 instead of <>, to avoid XML format confusion):
-
-{self.get_reply_format()}
-
-Please think deeply and reason based on your role, the game rules, and your available items, doing everything possible to win. If winning isn't possible, aim for a draw.
-
-Very important: Communication is a key element in this game! Please express your thoughts in the 【communication】 section.
-You can use these communication strategies:
-1. Deception strategy: Deliberately mislead your opponent about chamber positions or your intentions
-2. Pressure strategy: Try to make your opponent believe you have more information by showing confidence
-3. Surrender strategy: Persuade your opponent to give up or propose a compromise that benefits you
-4. Psychological warfare: Use words to influence your opponent's judgment or emotions
-
-Your communication will greatly influence the game outcome, don't stay silent, actively engage with your opponent!
-Combining item use with effective communication can create significant tactical advantages.
-
-Make sure to reply in the exact format above, using 【】 markers for sections, not any other tags."""
-
-        messages = [{"role": "user", "content": prompt}]
+        # Static rules and guidance go in a separate leading message so they can be prompt-cached
+        turn_prompt = _TURN_TEMPLATE.format_map({
+            "role_name": role.name,
+            "role_style": role.style,
+            "opponent_name": opponent.name,
+            "context": self._common_context(player),
+        })
+
+        messages = [
+            {"role": "system", "content": self._prompt_prefix},
+            {"role": "user", "content": turn_prompt},
+        ]
         
-        if DEBUG:
-            print_debug("Prompt sent to AI:")
+        if log.isEnabledFor(logging.DEBUG):
+            log.debug("Prompt sent to AI:")
             print_divider("-", 40)
-            print(prompt)
+            print(self._prompt_prefix + turn_prompt)
             print_divider("-", 40)
         
-        # Send message to LLM
+        # Send message to LLM and print the response as it streams in
         print_event(f"{player.name} thinking...")
-        start_time = time.time()
-        ai_response = player.llm_client.send_message(messages)
-        end_time = time.time()
-        print(f"Thinking time: {COLORS['yellow']}{end_time - start_time:.2f} seconds{COLORS['reset']}")
-        
-        # Print AI response with clear formatting
+        start_ns = time.perf_counter_ns()
         print_header(f"{player.name}'s Response", "cyan")
-        print(ai_response)
+        ai_response = ""
+        item_event = None
+        neg_prompt = neg_task = None
+        comm_closed = False
+        async for chunk in player.llm_client.stream_message_async(messages, cached_prefix_key=self._prompt_prefix_key):
+            sys.stdout.write(chunk)
+            sys.stdout.flush()
+            ai_response += chunk
+            # Once the communication block is complete, a negotiation request can go
+            # to the opponent while the proposer is still generating its fire section
+            if not comm_closed and _between(ai_response, "【communication】", "【communication end】") is not None:
+                comm_closed = True
+                early = self.parse_response(ai_response)
+                if early.get("communication") == "Negotiate":
+                    # The item section comes first and shapes the state the opponent sees
+                    item_event = self.apply_item_choice(player, early)
+                    neg_prompt, neg_task = self.start_negotiation(player, opponent, early.get('message', ''))
+        elapsed_ms = (time.perf_counter_ns() - start_ns) / 1e6
+        print()
+        print(f"Thinking time: {COLORS['yellow']}{elapsed_ms:.1f} ms{COLORS['reset']}")
         print_divider("-")
         
         # Parse response
         parsed = self.parse_response(ai_response)
-        if DEBUG:
-            print_debug(f"Parsed result: {parsed}")
+        log.debug("Parsed result: %s", parsed)
         
         # Process the player's actions
         # 1. Item usage
-        if parsed.get("item"):
-            result = self.handle_item_usage(player, parsed["item"], parsed.get("item_param"))
-            print_event(f"{player.name} uses item {parsed['item']}: {result}")
-        else:
-            print_event(f"{player.name} chooses not to use an item")
+        if item_event is None:
+            item_event = self.apply_item_choice(player, parsed)
+        print_event(item_event)
         
         # 2. Communication
         if parsed.get("communication") == "Negotiate":
             message = parsed.get('message', '')
             print_event(f"{player.name} proposes negotiation: {message}")
-            # Add to both logs
-            self.game_state.add_player_communication(f"{player.name} proposes negotiation: {message}")
-            
-            # Create a prompt for the opponent to consider the negotiation
-            neg_prompt = self.get_neg_prompt(player, opponent, message)
-
-            neg_messages = [{"role": "user", "content": neg_prompt}]
+            if neg_task is None:
+                neg_prompt, neg_task = self.start_negotiation(player, opponent, message)
             
-            if DEBUG:
-                print_debug("Negotiation consideration prompt:")
+            if log.isEnabledFor(logging.DEBUG):
+                log.debug("Negotiation consideration prompt:")
                 print_divider("-", 40)
                 print(neg_prompt)
                 print_divider("-", 40)
             
             print_event(f"Waiting for {opponent.name} to consider the negotiation request...")
-            opponent_response = opponent.llm_client.send_message(neg_messages)
+            opponent_response = await neg_task
             print_header(f"{opponent.name}'s Response", "cyan")
             print(opponent_response)
             print_divider("-")
@@ -553,7 +729,7 @@ Make sure to reply in the exact format above, using 【】 markers for sections,
             self.game_state.reset_reverse = True
         
         # Reset reverse after applying it
-        if hasattr(self.game_state, 'reset_reverse') and self.game_state.reset_reverse:
+        if self.game_state.reset_reverse:
             self.game_state.reverse_active = False
             self.game_state.reset_reverse = False
         
@@ -576,8 +752,8 @@ Make sure to reply in the exact format above, using 【】 markers for sections,
             print_event(f"Result: Miss (empty chamber)")
         
         # Show updated gun state after turn if debugging
-        if DEBUG:
-            print_debug("Gun state after turn:")
+        if log.isEnabledFor(logging.DEBUG):
+            log.debug("Gun state after turn:")
             print(self.game_state.visualize_gun())
         
         return True
@@ -595,6 +771,19 @@ Make sure to reply in the exact format above, using 【】 markers for sections,
     
     def run_game(self):
         """Run the game loop"""
+        from llm_client import close_async_clients
+        
+        async def run():
+            try:
+                await self.run_game_async()
+            finally:
+                # The connection pool belongs to this event loop
+                await close_async_clients()
+        
+        asyncio.run(run())
+    
+    async def run_game_async(self):
+        """Run the game loop inside an event loop"""
         game_active = True
         max_turns = 30  # Safety measure to prevent infinite loops
         turn_count = 0
@@ -606,7 +795,7 @@ Make sure to reply in the exact format above, using 【】 markers for sections,
             print_divider("=")
             print_header(f"Turn {turn_count + 1}", "white")
             
-            game_active = self.process_player_turn(player_idx)
+            game_active = await self.process_player_turn(player_idx)
             
             # If a player was hit, check contract but game will end
             if not game_active:
@@ -635,16 +824,34 @@ Make sure to reply in the exact format above, using 【】 markers for sections,
         print_header("Game Statistics", "blue")
         print(f"Total turns: {turn_count}")
         print(f"Total chambers: {self.chamber_count}")
-        print(f"Total bullets: {len(self.game_state.bullets)}")
+        print(f"Total bullets: {bin(self.game_state.bullets).count('1')}")
         
-        # Print full logs with bullet information for spectators
-        print_header("Detailed Game Log (with chamber information)", "magenta")
-        print(self.game_state.get_status(for_player=False))
+        # Full logs with bullet information go to a compressed file instead of the terminal
+        log_path = self.dump_log()
+        print(f"Detailed game log (with chamber information): {log_path}")
         
         # Final visualization of the gun
         print_header("Final Gun State", "yellow")
         print(self.game_state.visualize_gun())
 
+    def dump_log(self) -> str:
+        """Write the spectator log to a gzip file in the working directory and return its path"""
+        path = time.strftime("game_%Y%m%d_%H%M%S.log.gz")
+        with gzip.open(path, "wt", encoding="utf-8") as f:
+            f.write(self.game_state.get_status(for_player=False))
+            f.write("\n")
+        return path
+    
+    def _common_context(self, player: Player) -> str:
+        """Render the player-visible game state and the given player's items"""
+        return _CONTEXT_TEMPLATE.format_map({
+            "logs": self.game_state.get_status(for_player=True),
+            "position": self.game_state.current_position + 1,
+            "chamber_count": self.chamber_count,
+            "contract": 'Active' if self.game_state.contract_active else 'Inactive',
+            "items": player.get_items_string(),
+        })
+    
     def get_neg_prompt(self, player, opponent, message):
         """Generate a negotiation prompt for the opponent"""
         return f"""You are: {opponent.role}
@@ -653,18 +860,20 @@ In the current game, opponent {player.name} has proposed a draw negotiation.
 
 Negotiation content: "{message}"
 
-Current game status:
-{self.game_state.get_status(for_player=True)}
-
-Current trigger position: {self.game_state.current_position + 1}/{self.chamber_count}
-Contract status: {'Active' if self.game_state.contract_active else 'Inactive'}
-
-Your items: {opponent.get_items_string()}
+{self._common_context(opponent)}
 
 Consider the current game state, your character, and your chances of winning. Do you agree to this negotiation?
 Please respond with only "Agree" or "Decline" and a brief reason."""
 
 def main():
+    parser = argparse.ArgumentParser(description="Russian Roulette duel between LLMs")
+    parser.add_argument("--cache", action="store_true", help="Reuse locally cached LLM responses (an identical prompt replays the same reply)")
+    parser.add_argument("-v", "--verbose", action="store_true", help="Show spectator-only debug output even when DEBUG is off")
+    parser.add_argument("--seed", type=int, default=None, help="Seed for bullet placement, items and turn order, to replay a game")
+    args = parser.parse_args()
+    _ensure_color_init()
+    log.setLevel(logging.DEBUG if DEBUG or args.verbose else logging.INFO)
+    
     # Game configuration
     game_config = {
         "chamber_count": 8,  # Number of chambers in the gun
@@ -693,7 +902,7 @@ def main():
     print_divider("=")
     
     # Initialize and run the game
-    game = GameController(chamber_count=game_config["chamber_count"])
+    game = GameController(chamber_count=game_config["chamber_count"], use_cache=args.cache, seed=args.seed)
     game.setup_game(game_config["player_configs"])
     game.run_game()
 
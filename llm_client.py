@@ -1,103 +1,908 @@
+import io
 import os
 import json
-from typing import Any, List, Dict, Optional, Union
+import random
+import asyncio
+import atexit
+import hashlib
+import sqlite3
+import sys
+import threading
+import time
+import weakref
+from collections import deque
+from typing import TYPE_CHECKING, Any, Callable, List, Dict, Iterator, AsyncIterator, Optional, Union
 from abc import ABC, abstractmethod
-from openai import OpenAI
-import anthropic
+from functools import lru_cache, partial
+from types import MappingProxyType
+
+try:
+    import orjson  # Optional, faster JSON encoding and decoding
+except ImportError:
+    orjson = None
+
+if TYPE_CHECKING:
+    # The SDKs are imported by the clients that need them, so picking one provider never loads the other
+    from openai import OpenAI, AsyncOpenAI
+    from anthropic import AsyncAnthropic
 
 # 固定配置文件路径
 CONFIG_FILE = os.path.join(os.path.dirname(__file__), "config.json")
+# 响应缓存文件路径
+CACHE_FILE = os.path.join(os.path.dirname(__file__), "llm_cache.sqlite3")
+# 语义缓存使用的句向量模型
+EMBEDDING_MODEL = "sentence-transformers/all-MiniLM-L6-v2"
+# 请求数达到该值时 send_batch 改用服务商的批处理接口
+BATCH_THRESHOLD = 20
+# 临时性错误 (限流 / 连接 / 服务端错误) 的最大尝试次数与退避上限 (秒); SDK 自带的重试已关闭
+RETRY_ATTEMPTS = 5
+RETRY_MAX_DELAY = 30.0
+# create_llm_client 返回的共享客户端实例, 按 (provider, 服务商配置摘要) 索引
+_CLIENT_CACHE: Dict[tuple, "LLMClient"] = {}
+# 每个事件循环各自的异步连接池 ("http") 及基于它的异步 SDK 客户端 (按 LLMClient 索引);
+# 连接属于打开它的事件循环, 不能跨循环复用
+_LOOP_CLIENTS: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, Dict[Any, Any]]" = weakref.WeakKeyDictionary()
+
+def _json_dumps(obj: Any, sort_keys: bool = False) -> bytes:
+    """Compact UTF-8 JSON
+    
+    orjson and the json fallback agree on strings, ints, bools, None and
+    short floats such as the sampling values used in cache keys; floats
+    with exponents differ ("1e16" vs "1e+16").
+    """
+    if orjson is not None:
+        return orjson.dumps(obj, option=orjson.OPT_SORT_KEYS if sort_keys else 0)
+    return json.dumps(obj, sort_keys=sort_keys, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+def _json_loads(data: Union[str, bytes]) -> Any:
+    return orjson.loads(data) if orjson is not None else json.loads(data)
+
+def _http_pool_options() -> Dict[str, Any]:
+    """Keyword arguments shared by the sync and async connection pools"""
+    import httpx
+    try:
+        import h2  # noqa: F401  HTTP/2 multiplexes concurrent requests on one socket
+        http2 = True
+    except ImportError:
+        http2 = False
+    return {"http2": http2, "limits": httpx.Limits(max_connections=100, max_keepalive_connections=20)}
+
+@lru_cache(maxsize=None)
+def _http_client():
+    """Shared HTTP connection pool, so keep-alive sockets are reused by every client"""
+    import httpx
+    client = httpx.Client(**_http_pool_options())
+    atexit.register(client.close)
+    return client
+
+def _async_http_client():
+    """Async HTTP connection pool for the running event loop, shared by the async SDK clients"""
+    clients = _LOOP_CLIENTS.setdefault(asyncio.get_running_loop(), {})
+    if "http" not in clients:
+        import httpx
+        clients["http"] = httpx.AsyncClient(**_http_pool_options())
+    return clients["http"]
+
+def _loop_client(owner: "LLMClient", make: Callable[..., Any]):
+    """The async SDK client owner uses on the running event loop, built with make(http_client=...) on first use"""
+    http_client = _async_http_client()
+    clients = _LOOP_CLIENTS[asyncio.get_running_loop()]
+    if owner not in clients:
+        clients[owner] = make(http_client=http_client)
+    return clients[owner]
+
+async def close_async_clients() -> None:
+    """Close the running event loop's connection pool; call before the loop ends
+    
+    Async clients are built per event loop, so the next loop starts with a fresh pool.
+    """
+    clients = _LOOP_CLIENTS.pop(asyncio.get_running_loop(), {})
+    if "http" in clients:
+        await clients["http"].aclose()
+
+def _is_retryable(error: Exception) -> bool:
+    """Connection errors (timeouts included) and the statuses the SDKs themselves retry: 408, 409, 429 and 5xx"""
+    # Only an SDK that is already imported can have raised the error
+    for name in ("openai", "anthropic"):
+        sdk = sys.modules.get(name)
+        if sdk is None:
+            continue
+        if isinstance(error, sdk.APIConnectionError):
+            return True
+        if isinstance(error, sdk.APIStatusError):
+            # By status, so errors without a dedicated class (Anthropic's 529 overloaded) are covered
+            return error.status_code in (408, 409, 429) or error.status_code >= 500
+    return False
+
+class CircuitOpenError(RuntimeError):
+    """Raised instead of calling a provider that has been failing most requests"""
+
+class CircuitBreaker:
+    """Refuse calls while more than half of the recent calls failed
+    
+    Each call reports one outcome, after its retries. Once open, the
+    breaker refuses calls for `cooldown` seconds, then lets a single probe
+    through: success closes it, failure keeps it open for another cooldown.
+    
+    Args:
+        window: Seconds of history to consider
+        min_calls: Calls needed in the window before the breaker can open
+        cooldown: Seconds to wait while open before probing the provider
+    """
+    
+    def __init__(self, window: float = 60.0, min_calls: int = 4, cooldown: float = 30.0) -> None:
+        self.window = window
+        self.min_calls = min_calls
+        self.cooldown = cooldown
+        self._calls = deque()  # (monotonic time, succeeded)
+        self._opened_at: Optional[float] = None
+        self._probing = False
+        self._lock = threading.Lock()
+    
+    def check(self) -> None:
+        """Raise CircuitOpenError unless a call may go ahead; a caller let through must record() its outcome"""
+        with self._lock:
+            if self._opened_at is None:
+                return
+            if self._probing or time.monotonic() - self._opened_at < self.cooldown:
+                raise CircuitOpenError("Most recent calls to this provider failed, not calling the API")
+            self._probing = True
+    
+    def record(self, ok: bool) -> None:
+        with self._lock:
+            now = time.monotonic()
+            if self._probing:
+                self._probing = False
+                if ok:
+                    self._opened_at = None
+                    self._calls.clear()
+                else:
+                    self._opened_at = now
+                return
+            self._calls.append((now, ok))
+            cutoff = now - self.window
+            while self._calls[0][0] < cutoff:
+                self._calls.popleft()
+            failures = sum(1 for _, succeeded in self._calls if not succeeded)
+            if len(self._calls) >= self.min_calls and failures * 2 > len(self._calls):
+                self._opened_at = now
+
+def _retry_delay(attempt: int, error: Exception) -> float:
+    """Seconds to wait before retrying: the server's Retry-After if given, else jittered exponential backoff"""
+    response = getattr(error, "response", None)
+    retry_after = response.headers.get("retry-after") if response is not None else None
+    if retry_after:
+        try:
+            return min(float(retry_after), RETRY_MAX_DELAY)
+        except ValueError:
+            pass  # HTTP-date form, fall back to backoff
+    return random.uniform(0, min(RETRY_MAX_DELAY, 2 ** attempt))
+
+async def _acall_with_retry(breaker: CircuitBreaker, call):
+    """Await call(), retrying transient API errors; the last error propagates unchanged"""
+    breaker.check()
+    # Outcome reported to the breaker, once per call rather than per attempt; a
+    # non-transient error (bad request, auth) says nothing about the provider's health
+    ok = True
+    try:
+        for attempt in range(RETRY_ATTEMPTS):
+            try:
+                result = await call()
+            except Exception as e:
+                ok = not _is_retryable(e)
+                if ok or attempt == RETRY_ATTEMPTS - 1:
+                    raise
+                await asyncio.sleep(_retry_delay(attempt, e))
+            else:
+                ok = True
+                return result
+    finally:
+        breaker.record(ok)
+
+def _stream_with_retry(breaker: CircuitBreaker, open_stream) -> Iterator[str]:
+    """Yield from open_stream(), retrying transient errors only until the first chunk arrives"""
+    breaker.check()
+    ok = True  # As in _acall_with_retry
+    try:
+        for attempt in range(RETRY_ATTEMPTS):
+            started = False
+            try:
+                for chunk in open_stream():
+                    started = True
+                    yield chunk
+            except Exception as e:
+                ok = not _is_retryable(e)
+                # Once text has been handed out a retry would repeat it
+                if started or ok or attempt == RETRY_ATTEMPTS - 1:
+                    raise
+                time.sleep(_retry_delay(attempt, e))
+            else:
+                ok = True
+                return
+    finally:
+        breaker.record(ok)
+
+def _wait_for_batch(fetch, finished, initial_delay: float = 5.0, max_delay: float = 60.0):
+    """Poll a batch job with exponential backoff until finished(job) is true, then return the job"""
+    delay = initial_delay
+    while True:
+        job = fetch()
+        if finished(job):
+            return job
+        time.sleep(delay)
+        delay = min(delay * 2, max_delay)
+
+def _fold_system(messages: List[Dict[str, str]]) -> List[Dict[str, str]]:
+    """Prepend system message text to the first user message"""
+    system = "".join(m["content"] for m in messages if m["role"] == "system")
+    if not system:
+        return messages
+    folded = [dict(m) for m in messages if m["role"] != "system"]
+    for m in folded:
+        if m["role"] == "user":
+            m["content"] = system + m["content"]
+            break
+    else:
+        folded.insert(0, {"role": "user", "content": system})
+    return folded
+
+def _call_options(cached_prefix_key: Optional[str], max_tokens: Optional[int]) -> Dict[str, Any]:
+    """Keyword arguments for forwarding a call, leaving out the unset ones
+    
+    Clients that implement the original send_message(messages) signature
+    keep working as long as the caller does not ask for these options.
+    """
+    options = {}
+    if cached_prefix_key is not None:
+        options["cached_prefix_key"] = cached_prefix_key
+    if max_tokens is not None:
+        options["max_tokens"] = max_tokens
+    return options
 
 class LLMClient(ABC):
     """Abstract base class for LLM API clients"""
     
     @abstractmethod
-    def send_message(self, messages: List[Dict[str, str]]) -> str:
+    def send_message(self, messages: List[Dict[str, str]], *, cached_prefix_key: Optional[str] = None,
+                     max_tokens: Optional[int] = None) -> str:
         """Send a message to LLM and return response text
         
+        Subclasses may implement send_message(self, messages) alone; the
+        keyword options are only passed on when a caller sets them.
+        
         Args:
             messages: List of message objects with 'role' and 'content'
+            cached_prefix_key: Names a static leading system message that is
+                reused across calls, so providers with prompt caching can
+                skip reprocessing it. OpenAI and Anthropic only cache
+                prefixes of at least 1,024 tokens
+            max_tokens: Cap on the reply length for this call; None uses the
+                client's default. A small cap for short replies lets the
+                request finish sooner; clients whose model counts hidden
+                reasoning against the limit ignore it
             
         Returns:
             str: Response text
         """
         pass
 
+    async def send_message_async(self, messages: List[Dict[str, str]], *, cached_prefix_key: Optional[str] = None,
+                                 max_tokens: Optional[int] = None) -> str:
+        """Send a message to LLM without blocking the event loop
+        
+        By default the blocking SDK call runs in the default executor so
+        several requests can be in flight at once; clients with a native
+        async SDK override this.
+        
+        Args:
+            messages: List of message objects with 'role' and 'content'
+            cached_prefix_key: See send_message
+            
+        Returns:
+            str: Response text
+        """
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            None, partial(self.send_message, messages, **_call_options(cached_prefix_key, max_tokens))
+        )
+
+    async def submit_many_async(self, messages_list: List[List[Dict[str, str]]], max_concurrency: int = 8) -> List[str]:
+        """Send several independent conversations concurrently
+
+        Args:
+            messages_list: One message list per request
+            max_concurrency: Upper bound on requests in flight at once
+
+        Returns:
+            List[str]: Response texts in the same order as messages_list
+        """
+        semaphore = asyncio.Semaphore(max_concurrency)
+
+        async def send(messages):
+            async with semaphore:
+                return await self.send_message_async(messages)
+
+        return list(await asyncio.gather(*(send(m) for m in messages_list)))
+
+    def submit_many(self, messages_list: List[List[Dict[str, str]]], max_concurrency: int = 8) -> List[str]:
+        """Blocking wrapper around submit_many_async for callers without an event loop"""
+        async def run():
+            try:
+                return await self.submit_many_async(messages_list, max_concurrency)
+            finally:
+                await close_async_clients()
+        
+        return asyncio.run(run())
+
+    def send_batch(self, messages_list: List[List[Dict[str, str]]]) -> List[str]:
+        """Answer many independent conversations, for bulk offline workloads
+
+        Clients whose provider has a batch API use it from BATCH_THRESHOLD
+        requests on; it is cheaper but may take hours, so never call this
+        from an interactive loop. Smaller jobs, and clients without a batch
+        API, fall back to submit_many.
+
+        Args:
+            messages_list: One message list per request
+
+        Returns:
+            List[str]: Response texts in the same order as messages_list
+        """
+        return self.submit_many(messages_list)
+
+    def stream_message(self, messages: List[Dict[str, str]], *, cached_prefix_key: Optional[str] = None,
+                       max_tokens: Optional[int] = None) -> Iterator[str]:
+        """Send a message to LLM and yield the response text as it arrives
+        
+        Clients without a streaming API yield the whole response at once.
+        
+        Args:
+            messages: List of message objects with 'role' and 'content'
+            cached_prefix_key: See send_message
+            
+        Yields:
+            str: Chunks of response text
+        """
+        yield self.send_message(messages, **_call_options(cached_prefix_key, max_tokens))
+    
+    async def stream_message_async(self, messages: List[Dict[str, str]], *, cached_prefix_key: Optional[str] = None,
+                                   max_tokens: Optional[int] = None) -> AsyncIterator[str]:
+        """Async version of stream_message; each chunk is awaited in the default executor"""
+        loop = asyncio.get_running_loop()
+        chunks = self.stream_message(messages, **_call_options(cached_prefix_key, max_tokens))
+        done = object()
+        while True:
+            chunk = await loop.run_in_executor(None, next, chunks, done)
+            if chunk is done:
+                break
+            yield chunk
+
 class OpenAIBaseLLMClient(LLMClient):
     """Base client for OpenAI-compatible APIs"""
     
-    def __init__(self, client: OpenAI) -> None:
+    model = ""
+    # Sampling parameters; None leaves the provider default
+    temperature: Optional[float] = None
+    max_tokens: Optional[int] = None
+    
+    def __init__(self, client: "OpenAI", make_aclient: Callable[..., "AsyncOpenAI"]) -> None:
         self.client = client
+        self._make_aclient = make_aclient
+        self._breaker = CircuitBreaker()
+    
+    @property
+    def aclient(self) -> "AsyncOpenAI":
+        """Async SDK client on the running event loop's connection pool"""
+        return _loop_client(self, self._make_aclient)
+    
+    def request_params(self, messages: List[Dict[str, str]], cached_prefix_key: Optional[str] = None,
+                       max_tokens: Optional[int] = None) -> Dict[str, Any]:
+        """Build the keyword arguments for chat.completions.create"""
+        # The reasoning models used here take no system prompt, so it is sent as the start of the first user turn
+        params = {"model": self.model, "messages": _fold_system(messages)}
+        if self.temperature is not None:
+            params["temperature"] = self.temperature
+        if max_tokens is None:
+            max_tokens = self.max_tokens
+        if max_tokens is not None:
+            params["max_tokens"] = max_tokens
+        return params
+    
+    def send_message(self, messages: List[Dict[str, str]], *, cached_prefix_key: Optional[str] = None,
+                     max_tokens: Optional[int] = None) -> str:
+        # Streamed and joined, so the sync path shares one request/retry implementation with stream_message
+        return "".join(self.stream_message(messages, cached_prefix_key=cached_prefix_key, max_tokens=max_tokens))
+    
+    async def send_message_async(self, messages: List[Dict[str, str]], *, cached_prefix_key: Optional[str] = None,
+                                 max_tokens: Optional[int] = None) -> str:
+        params = self.request_params(messages, cached_prefix_key, max_tokens)
+        response = await _acall_with_retry(self._breaker, lambda: self.aclient.chat.completions.create(**params))
+        return response.choices[0].message.content
+    
+    def stream_message(self, messages: List[Dict[str, str]], *, cached_prefix_key: Optional[str] = None,
+                       max_tokens: Optional[int] = None) -> Iterator[str]:
+        params = self.request_params(messages, cached_prefix_key, max_tokens)
+        
+        def chunks():
+            for chunk in self.client.chat.completions.create(stream=True, **params):
+                if chunk.choices and chunk.choices[0].delta.content:
+                    yield chunk.choices[0].delta.content
+        
+        yield from _stream_with_retry(self._breaker, chunks)
 
 class DeepSeekLLMClient(OpenAIBaseLLMClient):
-    """Client for DeepSeek API"""
+    """Client for DeepSeek API
+    
+    DeepSeek caches shared prompt prefixes on its own, so cached_prefix_key
+    is not sent.
+    """
+    
+    model = "deepseek-reasoner"
+    temperature = 0.7
+    max_tokens = 1500
     
     def __init__(self, api_key: str, base_url: str) -> None:
-        super().__init__(OpenAI(api_key=api_key, base_url=base_url))
+        from openai import OpenAI, AsyncOpenAI
+        super().__init__(
+            OpenAI(api_key=api_key, base_url=base_url, http_client=_http_client(), max_retries=0),
+            partial(AsyncOpenAI, api_key=api_key, base_url=base_url, max_retries=0),
+        )
     
-    def send_message(self, messages: List[Dict[str, str]]) -> str:
-        try:
-            response = self.client.chat.completions.create(
-                model="deepseek-reasoner",
-                messages=messages,
-                max_tokens=1500,
-                temperature=0.7
-            )
-            
-            return response.choices[0].message.content
-        except Exception as e:
-            raise Exception(f"API error: {str(e)}")
+    def request_params(self, messages: List[Dict[str, str]], cached_prefix_key: Optional[str] = None,
+                       max_tokens: Optional[int] = None) -> Dict[str, Any]:
+        # deepseek-reasoner counts its reasoning against max_tokens, so a short
+        # per-call cap would cut the reply off mid-reasoning; the default stays
+        return super().request_params(messages, cached_prefix_key)
+
 
 class OpenAILLMClient(OpenAIBaseLLMClient):
     """Client for OpenAI API"""
     
+    model = "o1-mini"
+    
     def __init__(self, api_key: str) -> None:
-        super().__init__(OpenAI(api_key=api_key))
+        from openai import OpenAI, AsyncOpenAI
+        super().__init__(
+            OpenAI(api_key=api_key, http_client=_http_client(), max_retries=0),
+            partial(AsyncOpenAI, api_key=api_key, max_retries=0),
+        )
     
-    def send_message(self, messages: List[Dict[str, str]]) -> str:
-        try:
-            response = self.client.chat.completions.create(
-                model="o1-mini",
-                messages=messages
-            )
-            
-            return response.choices[0].message.content
-        except Exception as e:
-            raise Exception(f"API error: {str(e)}")
+    def request_params(self, messages: List[Dict[str, str]], cached_prefix_key: Optional[str] = None,
+                       max_tokens: Optional[int] = None) -> Dict[str, Any]:
+        # o1 counts its hidden reasoning against the output limit, so a short
+        # reply cap would leave nothing for the answer; it stays uncapped
+        params = super().request_params(messages, cached_prefix_key)
+        if cached_prefix_key:
+            # Routes requests sharing the prefix to the same prompt cache
+            params["extra_body"] = {"prompt_cache_key": cached_prefix_key}
+        return params
+    
+    def send_batch(self, messages_list: List[List[Dict[str, str]]]) -> List[str]:
+        if len(messages_list) < BATCH_THRESHOLD:
+            return super().send_batch(messages_list)
+        lines = [
+            _json_dumps({
+                "custom_id": str(i),
+                "method": "POST",
+                "url": "/v1/chat/completions",
+                "body": self.request_params(messages),
+            })
+            for i, messages in enumerate(messages_list)
+        ]
+        input_file = self.client.files.create(
+            file=("batch.jsonl", io.BytesIO(b"\n".join(lines))),
+            purpose="batch",
+        )
+        batch = self.client.batches.create(
+            input_file_id=input_file.id,
+            endpoint="/v1/chat/completions",
+            completion_window="24h",
+        )
+        batch = _wait_for_batch(
+            lambda: self.client.batches.retrieve(batch.id),
+            lambda job: job.status in ("completed", "failed", "expired", "cancelled"),
+        )
+        if batch.status != "completed":
+            raise Exception(f"OpenAI batch {batch.id} ended with status {batch.status}")
+        
+        # Failed requests are written to the error file, or to the output file
+        # with an error object or a non-200 status
+        entries = []
+        for file_id in (batch.output_file_id, batch.error_file_id):
+            if file_id:
+                entries.extend(_json_loads(line) for line in self.client.files.content(file_id).text.splitlines() if line)
+        
+        responses = [None] * len(messages_list)
+        for entry in entries:
+            response = entry.get("response") or {}
+            body = response.get("body") or {}
+            if entry.get("error") or response.get("status_code") != 200 or not body.get("choices"):
+                error = entry.get("error") or body.get("error") or f"status {response.get('status_code')}"
+                raise Exception(f"OpenAI batch request {entry.get('custom_id')} failed: {error}")
+            responses[int(entry["custom_id"])] = body["choices"][0]["message"]["content"]
+        if None in responses:
+            raise Exception(f"OpenAI batch {batch.id} is missing {responses.count(None)} results")
+        return responses
 
 class AnthropicLLMClient(LLMClient):
     """Client for Anthropic API"""
     
+    model = "claude-3-7-sonnet-20250219"
+    temperature = 1
+    max_tokens = 2500
+    thinking_budget = 1200
+    
     def __init__(self, api_key: str) -> None:
-        self.client = anthropic.Anthropic(api_key=api_key)
+        import anthropic
+        self.client = anthropic.Anthropic(api_key=api_key, http_client=_http_client(), max_retries=0)
+        self._make_aclient = partial(anthropic.AsyncAnthropic, api_key=api_key, max_retries=0)
+        self._breaker = CircuitBreaker()
     
-    def send_message(self, messages: List[Dict[str, str]]) -> str:
-        try:
-            # Extract system message if present
-            system_message = ""
-            conversation = []
-            
-            for msg in messages:
-                if msg["role"] == "system":
-                    system_message = msg["content"]
-                else:
-                    conversation.append(msg)
-            
-            response = self.client.messages.create(
-                model="claude-3-7-sonnet-20250219",
-                system=system_message,
-                messages=[{"role": m["role"], "content": m["content"]} for m in conversation],
-                max_tokens=2500,
-                temperature=1,
-                thinking={
-                    "type": "enabled",
-                    "budget_tokens": 1200
-                }
+    @property
+    def aclient(self) -> "AsyncAnthropic":
+        """Async SDK client on the running event loop's connection pool"""
+        return _loop_client(self, self._make_aclient)
+    
+    def request_params(self, messages: List[Dict[str, str]], cached_prefix_key: Optional[str] = None,
+                       max_tokens: Optional[int] = None) -> Dict[str, Any]:
+        """Build the keyword arguments for messages.create"""
+        # Extract system message if present
+        system_message = ""
+        conversation = []
+        
+        for msg in messages:
+            if msg["role"] == "system":
+                system_message = msg["content"]
+            else:
+                conversation.append(msg)
+        
+        system: Union[str, List[Dict[str, Any]]] = system_message
+        if cached_prefix_key and system_message:
+            # Mark the static system prompt as a prompt-cache breakpoint
+            system = [{"type": "text", "text": system_message, "cache_control": {"type": "ephemeral"}}]
+        
+        if max_tokens is None:
+            max_tokens = self.max_tokens
+        params = {
+            "model": self.model,
+            "system": system,
+            "messages": conversation,  # Callers already pass {"role", "content"} dicts
+            "max_tokens": max_tokens,
+            "temperature": self.temperature,
+        }
+        # The thinking budget must fit inside max_tokens; a reply capped below it is answered without thinking
+        if max_tokens > self.thinking_budget:
+            params["thinking"] = {
+                "type": "enabled",
+                "budget_tokens": self.thinking_budget
+            }
+        return params
+    
+    def send_message(self, messages: List[Dict[str, str]], *, cached_prefix_key: Optional[str] = None,
+                     max_tokens: Optional[int] = None) -> str:
+        # Streamed and joined; text_stream already skips the thinking block
+        return "".join(self.stream_message(messages, cached_prefix_key=cached_prefix_key, max_tokens=max_tokens))
+    
+    async def send_message_async(self, messages: List[Dict[str, str]], *, cached_prefix_key: Optional[str] = None,
+                                 max_tokens: Optional[int] = None) -> str:
+        params = self.request_params(messages, cached_prefix_key, max_tokens)
+        response = await _acall_with_retry(self._breaker, lambda: self.aclient.messages.create(**params))
+        # Skip the thinking block, when there is one
+        return next(block.text for block in response.content if block.type == "text")
+    
+    def stream_message(self, messages: List[Dict[str, str]], *, cached_prefix_key: Optional[str] = None,
+                       max_tokens: Optional[int] = None) -> Iterator[str]:
+        params = self.request_params(messages, cached_prefix_key, max_tokens)
+        
+        def chunks():
+            # text_stream only carries the answer, not the thinking block
+            with self.client.messages.stream(**params) as stream:
+                yield from stream.text_stream
+        
+        yield from _stream_with_retry(self._breaker, chunks)
+    
+    def send_batch(self, messages_list: List[List[Dict[str, str]]]) -> List[str]:
+        if len(messages_list) < BATCH_THRESHOLD:
+            return super().send_batch(messages_list)
+        batch = self.client.messages.batches.create(requests=[
+            {"custom_id": str(i), "params": self.request_params(messages)}
+            for i, messages in enumerate(messages_list)
+        ])
+        batch = _wait_for_batch(
+            lambda: self.client.messages.batches.retrieve(batch.id),
+            lambda job: job.processing_status == "ended",
+        )
+        
+        responses = [None] * len(messages_list)
+        for entry in self.client.messages.batches.results(batch.id):
+            if entry.result.type != "succeeded":
+                raise Exception(f"Anthropic batch request {entry.custom_id} {entry.result.type}")
+            responses[int(entry.custom_id)] = next(block.text for block in entry.result.message.content if block.type == "text")
+        return responses
+
+class CachedLLMClient(LLMClient):
+    """Wrap an LLM client with a persistent exact-match response cache
+    
+    Responses are stored in SQLite keyed on (provider, model, prompt hash),
+    where the hash covers the messages and the wrapped client's sampling
+    parameters, so an identical request is answered without another API
+    call. Wrapping a client is the opt-in: with a non-zero temperature a
+    cached reply is one sample, replayed.
+    """
+    
+    def __init__(self, client: LLMClient, provider: str, cache_file: str = CACHE_FILE) -> None:
+        self.client = client
+        self.provider = provider
+        self.model = getattr(client, "model", "")
+        self.temperature = getattr(client, "temperature", None)
+        self.max_tokens = getattr(client, "max_tokens", None)
+        # The connection is shared with executor threads, so guard it with a lock
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(cache_file, check_same_thread=False)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            "provider TEXT, model TEXT, prompt_hash TEXT, response TEXT, "
+            "PRIMARY KEY (provider, model, prompt_hash))"
+        )
+        self._db.commit()
+    
+    @staticmethod
+    def hash_messages(messages: List[Dict[str, str]], **params: Any) -> str:
+        """Return a stable hash of the message list and any request parameters"""
+        payload = _json_dumps({"messages": messages, **params}, sort_keys=True)
+        return hashlib.blake2b(payload).hexdigest()
+    
+    def _key(self, messages: List[Dict[str, str]], max_tokens: Optional[int] = None) -> tuple:
+        if max_tokens is None:
+            max_tokens = self.max_tokens
+        prompt_hash = self.hash_messages(messages, temperature=self.temperature, max_tokens=max_tokens)
+        return (self.provider, self.model, prompt_hash)
+    
+    def _lookup(self, key: tuple) -> Optional[str]:
+        with self._lock:
+            row = self._db.execute(
+                "SELECT response FROM responses WHERE provider = ? AND model = ? AND prompt_hash = ?",
+                key
+            ).fetchone()
+        return None if row is None else row[0]
+    
+    def _store(self, key: tuple, response: str) -> None:
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO responses (provider, model, prompt_hash, response) VALUES (?, ?, ?, ?)",
+                key + (response,)
             )
-            
-            return response.content[1].text
-        except Exception as e:
-            raise Exception(f"Anthropic API error: {str(e)}")
+            self._db.commit()
+    
+    def send_message(self, messages: List[Dict[str, str]], *, cached_prefix_key: Optional[str] = None,
+                     max_tokens: Optional[int] = None) -> str:
+        key = self._key(messages, max_tokens)
+        response = self._lookup(key)
+        if response is None:
+            response = self.client.send_message(messages, **_call_options(cached_prefix_key, max_tokens))
+            self._store(key, response)
+        return response
+    
+    async def send_message_async(self, messages: List[Dict[str, str]], *, cached_prefix_key: Optional[str] = None,
+                                 max_tokens: Optional[int] = None) -> str:
+        key = self._key(messages, max_tokens)
+        response = self._lookup(key)
+        if response is None:
+            response = await self.client.send_message_async(messages, **_call_options(cached_prefix_key, max_tokens))
+            self._store(key, response)
+        return response
+    
+    def stream_message(self, messages: List[Dict[str, str]], *, cached_prefix_key: Optional[str] = None,
+                       max_tokens: Optional[int] = None) -> Iterator[str]:
+        key = self._key(messages, max_tokens)
+        response = self._lookup(key)
+        if response is not None:
+            yield response
+            return
+        
+        chunks = []
+        for chunk in self.client.stream_message(messages, **_call_options(cached_prefix_key, max_tokens)):
+            chunks.append(chunk)
+            yield chunk
+        self._store(key, "".join(chunks))
+
+@lru_cache(maxsize=None)
+def _load_encoder(model_name: str):
+    """Load a sentence-transformer once per process"""
+    from sentence_transformers import SentenceTransformer
+    return SentenceTransformer(model_name)
+
+class SemanticCachedLLMClient(LLMClient):
+    """Wrap an LLM client with an in-process semantic response cache
+    
+    The last message of each prompt is embedded and compared against earlier
+    prompts whose preceding messages match exactly; when the cosine
+    similarity reaches the threshold the earlier response is reused. Put
+    anything a reply must not be reused across in those earlier messages.
+    The embedding model only reads the start of the text (256 word pieces
+    for the default model, one per CJK character) and a small edit can still
+    score above the threshold, so the last message is best kept to text
+    whose exact wording does not decide the answer. Requires the optional
+    faiss and sentence-transformers packages.
+    
+    Args:
+        client: The client to wrap
+        threshold: Minimum cosine similarity for reusing a response
+        embedding_model: Sentence-transformers model used for embeddings
+        ttl: Seconds a stored response stays reusable; None keeps it forever
+        max_temperature: When the wrapped client samples above this
+            temperature every request goes through uncached; None never bypasses
+    """
+    
+    def __init__(self, client: LLMClient, threshold: float = 0.97, embedding_model: str = EMBEDDING_MODEL,
+                 ttl: Optional[float] = None, max_temperature: Optional[float] = None) -> None:
+        try:
+            import faiss
+            encoder = _load_encoder(embedding_model)
+        except ImportError as e:
+            raise ImportError("Semantic caching requires the 'faiss-cpu' and 'sentence-transformers' packages") from e
+        
+        self.client = client
+        self.model = getattr(client, "model", "")
+        self.temperature = getattr(client, "temperature", None)
+        self.max_tokens = getattr(client, "max_tokens", None)
+        self.threshold = threshold
+        self.ttl = ttl
+        self.bypass = max_temperature is not None and (self.temperature or 0) > max_temperature
+        self._faiss = faiss
+        self._encoder = encoder
+        # One (index, responses, stored_at) per exact-match scope
+        self._scopes: Dict[str, tuple] = {}
+        self._lock = threading.Lock()
+    
+    def _embed(self, messages: List[Dict[str, str]]) -> tuple:
+        """Return the exact-match scope of the earlier messages and the last message's embedding"""
+        scope = hashlib.blake2b(_json_dumps(messages[:-1]), digest_size=16).hexdigest()
+        embedding = self._encoder.encode(
+            [messages[-1]["content"]], normalize_embeddings=True
+        ).astype("float32")
+        return scope, embedding
+    
+    def _lookup(self, query: tuple) -> Optional[str]:
+        scope, embedding = query
+        with self._lock:
+            entry = self._scopes.get(scope)
+            if entry is None:
+                return None
+            index, responses, stored_at = entry
+            # A few neighbours, so an expired best match can fall back to a fresh one
+            scores, ids = index.search(embedding, min(index.ntotal, 4))
+            now = time.monotonic()
+            for score, idx in zip(scores[0], ids[0]):
+                if score < self.threshold:
+                    break
+                if self.ttl is None or now - stored_at[idx] <= self.ttl:
+                    return responses[idx]
+        return None
+    
+    def _store(self, query: tuple, response: str) -> None:
+        scope, embedding = query
+        with self._lock:
+            entry = self._scopes.get(scope)
+            if entry is None:
+                # Inner product over normalized vectors is cosine similarity
+                index = self._faiss.IndexFlatIP(self._encoder.get_sentence_embedding_dimension())
+                entry = self._scopes[scope] = (index, [], [])
+            index, responses, stored_at = entry
+            index.add(embedding)
+            responses.append(response)
+            stored_at.append(time.monotonic())
+    
+    def send_message(self, messages: List[Dict[str, str]], *, cached_prefix_key: Optional[str] = None,
+                     max_tokens: Optional[int] = None) -> str:
+        if self.bypass:
+            return self.client.send_message(messages, **_call_options(cached_prefix_key, max_tokens))
+        query = self._embed(messages)
+        response = self._lookup(query)
+        if response is None:
+            response = self.client.send_message(messages, **_call_options(cached_prefix_key, max_tokens))
+            self._store(query, response)
+        return response
+    
+    async def send_message_async(self, messages: List[Dict[str, str]], *, cached_prefix_key: Optional[str] = None,
+                                 max_tokens: Optional[int] = None) -> str:
+        if self.bypass:
+            return await self.client.send_message_async(messages, **_call_options(cached_prefix_key, max_tokens))
+        query = self._embed(messages)
+        response = self._lookup(query)
+        if response is None:
+            response = await self.client.send_message_async(messages, **_call_options(cached_prefix_key, max_tokens))
+            self._store(query, response)
+        return response
+    
+    def stream_message(self, messages: List[Dict[str, str]], *, cached_prefix_key: Optional[str] = None,
+                       max_tokens: Optional[int] = None) -> Iterator[str]:
+        if self.bypass:
+            yield from self.client.stream_message(messages, **_call_options(cached_prefix_key, max_tokens))
+            return
+        query = self._embed(messages)
+        response = self._lookup(query)
+        if response is not None:
+            yield response
+            return
+        
+        chunks = []
+        for chunk in self.client.stream_message(messages, **_call_options(cached_prefix_key, max_tokens)):
+            chunks.append(chunk)
+            yield chunk
+        self._store(query, "".join(chunks))
+
+class ChatSession:
+    """A multi-turn conversation that keeps only the most recent turns
+    
+    The system prompt stays fixed at the front, so providers with prefix
+    caching can reuse it, and request size stays bounded however long the
+    conversation runs.
+    
+    Args:
+        client: Client used to answer
+        system: System prompt sent with every request
+        max_turns: Number of user/assistant exchanges to keep
+    """
+    
+    def __init__(self, client: LLMClient, system: str, max_turns: int = 16) -> None:
+        self.client = client
+        self._system = {"role": "system", "content": system}
+        self._history = deque(maxlen=max_turns * 2)
+    
+    def __iter__(self) -> Iterator[Dict[str, str]]:
+        yield self._system
+        yield from self._history
+    
+    def _record(self, user_message: Dict[str, str], reply: str) -> None:
+        # Appended only once answered, so the window always drops whole exchanges
+        self._history.append(user_message)
+        self._history.append({"role": "assistant", "content": reply})
+    
+    def send(self, user_text: str) -> str:
+        """Send a user message with the recent history and record the exchange"""
+        user_message = {"role": "user", "content": user_text}
+        reply = self.client.send_message([*self, user_message])
+        self._record(user_message, reply)
+        return reply
+    
+    async def send_async(self, user_text: str) -> str:
+        """Async version of send"""
+        user_message = {"role": "user", "content": user_text}
+        reply = await self.client.send_message_async([*self, user_message])
+        self._record(user_message, reply)
+        return reply
+
+@lru_cache(maxsize=4)
+def _load_config(mtime_ns: int) -> Dict[str, Any]:
+    """Parse CONFIG_FILE; keyed on its modification time so edits are picked up"""
+    with open(CONFIG_FILE, 'rb') as f:
+        return _json_loads(f.read())
+
+def _resolve_key(section: Dict[str, Any]) -> str:
+    """Read the API key from the environment variable named in a config section"""
+    api_key_env = section.get("api_key")
+    api_key = os.getenv(api_key_env) if api_key_env else None
+    if not api_key:
+        raise ValueError(f"API key environment variable {api_key_env} not set")
+    return api_key
+
+@lru_cache(maxsize=16)
+def _provider_settings(provider: str, mtime_ns: int) -> MappingProxyType:
+    """Resolve a provider's config section, with the API key read from its environment variable
+    
+    Keyed on CONFIG_FILE's modification time like _load_config, so a config
+    edit is picked up on the next call; a missing key raises (and is not cached).
+    """
+    section = _load_config(mtime_ns).get(provider, {})
+    return MappingProxyType({**section, "api_key": _resolve_key(section)})
+
+# 各服务商的客户端构造函数, 参数为 _provider_settings 的结果
+_BUILDERS = {
+    "deepseek": lambda settings: DeepSeekLLMClient(settings["api_key"], settings.get("base_url", "https://api.deepseek.com")),
+    "openai": lambda settings: OpenAILLMClient(settings["api_key"]),
+    "anthropic": lambda settings: AnthropicLLMClient(settings["api_key"]),
+}
 
 def create_llm_client(provider: str) -> LLMClient:
     """Create an appropriate LLM client based on the provider name
@@ -106,74 +911,45 @@ def create_llm_client(provider: str) -> LLMClient:
         provider: The provider name ('deepseek', 'openai', or 'anthropic')
         
     Returns:
-        LLMClient: An instance of the appropriate LLM client
+        LLMClient: A client instance, shared with every other caller asking
+            for the same provider with the same settings
     """
-    # Load configuration from file
-    with open(CONFIG_FILE, 'r', encoding='utf-8') as f:
-        config = json.load(f)
-    
-    if provider == "deepseek":
-        api_key_env = config.get("deepseek", {}).get("api_key")
-        base_url = config.get("deepseek", {}).get("base_url", "https://api.deepseek.com")
-        api_key = os.getenv(api_key_env)
-        if not api_key:
-            raise ValueError(f"API key environment variable {api_key_env} not set")
-        return DeepSeekLLMClient(api_key, base_url)
-    
-    elif provider == "openai":
-        api_key_env = config.get("openai", {}).get("api_key")
-        api_key = os.getenv(api_key_env)
-        if not api_key:
-            raise ValueError(f"API key environment variable {api_key_env} not set")
-        return OpenAILLMClient(api_key)
-    
-    elif provider == "anthropic":
-        api_key_env = config.get("anthropic", {}).get("api_key")
-        api_key = os.getenv(api_key_env)
-        if not api_key:
-            raise ValueError(f"API key environment variable {api_key_env} not set")
-        return AnthropicLLMClient(api_key)
+    build = _BUILDERS.get(provider)
+    if build is None:
+        raise ValueError(f"Unknown provider: {provider}. Available: {', '.join(_BUILDERS)}")
+    settings = _provider_settings(provider, os.stat(CONFIG_FILE).st_mtime_ns)
     
-    else:
-        raise ValueError(f"Unknown provider: {provider}. Available: deepseek, openai, anthropic")
+    # Reuse the SDK client, and with it the connection pool, for repeated requests
+    # Key on every resolved setting, so a new base_url is picked up as well as a new key
+    digest = hashlib.blake2b(_json_dumps(sorted(settings.items())), digest_size=8).hexdigest()
+    key = (provider, digest)
+    client = _CLIENT_CACHE.get(key)
+    if client is None:
+        client = _CLIENT_CACHE[key] = build(settings)
+    return client
 
 # 测试样例
-def test_llm_clients():
-    """Test all available LLM clients"""
+def test_llm_clients(providers: List[str]) -> None:
+    """Send a test question to each of the given providers"""
     
     test_messages = [
         {"role": "user", "content": "What is the capital of France?"}
     ]
     
-    # 测试 OpenAI
-    if False:
-        try:
-            print("\n--- Testing OpenAI Client ---")
-            openai_client = create_llm_client("openai")
-            response = openai_client.send_message(test_messages)
-            print(f"OpenAI Response: {response}")
-        except Exception as e:
-            print(f"OpenAI test failed: {e}")
-    
-    # 测试 Anthropic
-    if True:
+    for provider in providers:
         try:
-            print("\n--- Testing Anthropic Client ---")
-            anthropic_client = create_llm_client("anthropic")
-            response = anthropic_client.send_message(test_messages)
-            print(f"Anthropic Response: {response}")
+            print(f"\n--- Testing {provider} client ---")
+            client = create_llm_client(provider)
+            response = client.send_message(test_messages)
+            print(f"{provider} response: {response}")
         except Exception as e:
-            print(f"Anthropic test failed: {e}")
-    
-    # 测试 DeepSeek
-    if False:
-        try:
-            print("\n--- Testing DeepSeek Client ---")
-            deepseek_client = create_llm_client("deepseek")
-            response = deepseek_client.send_message(test_messages)
-            print(f"DeepSeek Response: {response}")
-        except Exception as e:
-            print(f"DeepSeek test failed: {e}")
+            print(f"{provider} test failed: {e}")
 
 if __name__ == "__main__":
-    test_llm_clients()
\ No newline at end of file
+    import argparse
+    
+    parser = argparse.ArgumentParser(description="Send a test question to LLM providers")
+    parser.add_argument("--test", action="append", choices=list(_BUILDERS),
+                        help="Provider to test; repeat for several (default: anthropic)")
+    args = parser.parse_args()
+    test_llm_clients(args.test or ["anthropic"])